@@ -1,6 +1,16 @@
-import json
 import re
 
+try:
+    import orjson
+
+    def dumps_line(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    import json
+
+    def dumps_line(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
 # Blueprint dari lo
 module_definitions = {
     "product_upload": {
@@ -36,35 +46,31 @@ SYSTEM_PROMPT = """Kamu adalah Expert Agent Planner. Tugas kamu adalah membuat d
 7. Performance considerations
 8. Compliance requirements"""
 
-def generate_planning_response(module_name, module_data):
-    """Generate detailed planning response from blueprint"""
-    
-    # Mapping validation types to human readable format
-    validation_mapping = {
-        "file_extension": "File Extension: hanya .jpg, .jpeg, .png, .webp",
-        "file_size": "File Size: max 2MB per file (client), 5MB (server)",
-        "file_count": "File Count: max 5 gambar per produk",
-        "mime_type": "MIME Type: validate actual content type matches extension",
-        "email_format": "Email Format: RFC 5322 compliant validation",
-        "password_strength": "Password Strength: min 8 chars, uppercase, number, symbol",
-        "phone_format": "Phone Format: E.164 format validation (opsional)"
-    }
-    
-    # Mapping compliance to human readable
-    compliance_mapping = {
-        "gdpr": "GDPR: explicit consent untuk data processing, right to delete",
-        "ccpa": "CCPA: California Consumer Privacy Act compliance",
-        "accessibility": "Accessibility: WCAG 2.1 compliance, screen reader support"
-    }
-    
-    # Generate response based on module type
-    if module_name == "product_upload":
-        return f"""**MODULE DEFINITION: PRODUCT IMAGE UPLOAD**
+# Mapping validation types to human readable format (sudah diprefix "- ")
+VALIDATION_LINES = {
+    "file_extension": "- File Extension: hanya .jpg, .jpeg, .png, .webp",
+    "file_size": "- File Size: max 2MB per file (client), 5MB (server)",
+    "file_count": "- File Count: max 5 gambar per produk",
+    "mime_type": "- MIME Type: validate actual content type matches extension",
+    "email_format": "- Email Format: RFC 5322 compliant validation",
+    "password_strength": "- Password Strength: min 8 chars, uppercase, number, symbol",
+    "phone_format": "- Phone Format: E.164 format validation (opsional)"
+}
+
+# Mapping compliance to human readable (sudah diprefix "- ")
+COMPLIANCE_LINES = {
+    "gdpr": "- GDPR: explicit consent untuk data processing, right to delete",
+    "ccpa": "- CCPA: California Consumer Privacy Act compliance",
+    "accessibility": "- Accessibility: WCAG 2.1 compliance, screen reader support"
+}
+
+# Response templates per module (str.format, dibangun sekali di module scope)
+PRODUCT_TEMPLATE = """**MODULE DEFINITION: PRODUCT IMAGE UPLOAD**
 
-**CORE FUNCTIONALITY**: {module_data['core_functionality']}
+**CORE FUNCTIONALITY**: {core_functionality}
 
 **REQUIRED VALIDATIONS**:
-{chr(10).join(['- ' + validation_mapping[val] for val in module_data['required_validations']])}
+{validations_block}
 
 **TECH STACK DEPENDENCIES**:
 - Frontend: react-dropzone, react-hook-form
@@ -72,7 +78,7 @@ def generate_planning_response(module_name, module_data):
 - Database: PostgreSQL untuk metadata storage
 
 **COMPLIANCE REQUIREMENTS**:
-{chr(10).join(['- ' + compliance_mapping[req] for req in module_data['compliance_requirements']])}
+{compliance_block}
 
 **PERFORMANCE METRICS**:
 - Upload time: <15 detik untuk 5 gambar di 4G
@@ -105,14 +111,13 @@ def generate_planning_response(module_name, module_data):
 □ All validation rules implemented di frontend dan backend
 □ No security vulnerabilities in penetration testing
 □ Performance metrics tercapai di real-world conditions"""
-    
-    elif module_name == "user_registration":
-        return f"""**MODULE DEFINITION: USER REGISTRATION**
 
-**CORE FUNCTIONALITY**: {module_data['core_functionality']}
+USER_REG_TEMPLATE = """**MODULE DEFINITION: USER REGISTRATION**
+
+**CORE FUNCTIONALITY**: {core_functionality}
 
 **REQUIRED VALIDATIONS**:
-{chr(10).join(['- ' + validation_mapping[val] for val in module_data['required_validations']])}
+{validations_block}
 
 **TECH STACK DEPENDENCIES**:
 - Email Service: nodemailer + SendGrid/Mailgun
@@ -121,7 +126,7 @@ def generate_planning_response(module_name, module_data):
 - Database: PostgreSQL untuk user storage
 
 **COMPLIANCE REQUIREMENTS**:
-{chr(10).join(['- ' + compliance_mapping[req] for req in module_data['compliance_requirements']])}
+{compliance_block}
 
 **PERFORMANCE METRICS**:
 - Signup completion time: <30 detik
@@ -158,21 +163,52 @@ def generate_planning_response(module_name, module_data):
 □ Email verification link valid hanya 24 jam
 □ No security vulnerabilities in authentication flow
 □ Full compliance dengan GDPR/CCPA requirements"""
+
+UNKNOWN_MODULE_RESPONSE = "Module tidak dikenali. Silakan spesifikasikan module yang dibutuhkan."
+
+def _blueprint_renderer(template):
+    """Buat renderer module_data -> response untuk template dengan slot blueprint standar."""
+    render = template.format
     
-    else:
-        return "Module tidak dikenali. Silakan spesifikasikan module yang dibutuhkan."
-
-# Generate JSONL file
-with open('agent_planner_dataset.jsonl', 'w', encoding='utf-8') as f:
-    for module_name, module_data in module_definitions.items():
-        chat_template = {
-            "messages": [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_requests[module_name]},
-                {"role": "assistant", "content": generate_planning_response(module_name, module_data)}
-            ]
-        }
-        f.write(json.dumps(chat_template, ensure_ascii=False) + '\n')
+    def _render(module_data):
+        return render(
+            core_functionality=module_data['core_functionality'],
+            validations_block="\n".join(VALIDATION_LINES[val] for val in module_data['required_validations']),
+            compliance_block="\n".join(COMPLIANCE_LINES[req] for req in module_data['compliance_requirements'])
+        )
+    
+    return _render
+
+_render_product_upload = _blueprint_renderer(PRODUCT_TEMPLATE)
+_render_user_registration = _blueprint_renderer(USER_REG_TEMPLATE)
+
+def _render_default(module_data):
+    return UNKNOWN_MODULE_RESPONSE
+
+# Module baru cukup didaftarkan di sini, tanpa ubah generate_planning_response
+TEMPLATE_REGISTRY = {
+    "product_upload": _render_product_upload,
+    "user_registration": _render_user_registration
+}
+
+def generate_planning_response(module_name, module_data):
+    """Generate detailed planning response from blueprint"""
+    return TEMPLATE_REGISTRY.get(module_name, _render_default)(module_data)
+
+# Generate JSONL file (satu write, block-buffered)
+lines = []
+for module_name, module_data in module_definitions.items():
+    chat_template = {
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_requests[module_name]},
+            {"role": "assistant", "content": generate_planning_response(module_name, module_data)}
+        ]
+    }
+    lines.append(dumps_line(chat_template))
+
+with open('agent_planner_dataset.jsonl', 'wb', buffering=1 << 20) as f:
+    f.write(b"\n".join(lines) + b"\n")
 
 print("✅ Dataset JSONL berhasil generate: agent_planner_dataset.jsonl")
 print(f"📊 Total module: {len(module_definitions)}")
\ No newline at end of file
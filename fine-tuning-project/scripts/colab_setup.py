@@ -4,27 +4,37 @@ Pre-Training Setup Script untuk Google Colab
 
 Jalankan script ini di cell pertama sebelum training.
 Script ini akan:
-1. Setup HuggingFace cache directory
+1. Setup HuggingFace cache directory (+ PyTorch CUDA allocator config)
 2. Install dependencies dengan T4 GPU compatibility
 3. Pre-download model ke cache
 
 Usage di Colab:
     !python scripts/colab_setup.py
     
-Atau copy-paste isi script ke cell pertama notebook.
+Atau copy-paste isi script ke cell pertama notebook (jalankan dari
+project root supaya src.utils bisa di-import).
 """
 
 import os
 import subprocess
 import sys
+from pathlib import Path
+
+# Tambahkan project root ke path (src.utils tanpa import pihak ketiga,
+# jadi aman dipakai sebelum install_dependencies)
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.utils.cuda_alloc import CUDA_ALLOC_CONF
 
 # ===== KONSTANTA =====
 HF_CACHE_DIR = "/content/hf_cache"
 DEFAULT_MODEL = "Qwen/Qwen3-0.6B"
+# Cukup weights + config/tokenizer, skip duplikat .bin dan docs
+MODEL_ALLOW_PATTERNS = ["*.safetensors", "*.json", "tokenizer*", "*.model"]
 
 
 def setup_cache_directory():
-    """Setup HuggingFace cache directory untuk Colab."""
+    """Setup HuggingFace cache directory dan CUDA allocator config untuk Colab."""
     print("📁 Setting up cache directories...")
     
     # Set environment variables
@@ -32,6 +42,11 @@ def setup_cache_directory():
     os.environ['TRANSFORMERS_CACHE'] = f"{HF_CACHE_DIR}/transformers"
     os.environ['HF_HUB_CACHE'] = f"{HF_CACHE_DIR}/hub"
     
+    # Expandable segments (CUDA VMM): caching allocator bisa grow region yang
+    # contiguous, jadi fragmentasi tidak bikin OOM di T4 16GB. Harus di-set
+    # sebelum alokasi CUDA pertama; value yang sudah di-set user tetap dipakai.
+    os.environ.setdefault('PYTORCH_CUDA_ALLOC_CONF', CUDA_ALLOC_CONF)
+    
     # Create directories
     os.makedirs(HF_CACHE_DIR, exist_ok=True)
     os.makedirs(f"{HF_CACHE_DIR}/transformers", exist_ok=True)
@@ -40,6 +55,30 @@ def setup_cache_directory():
     print(f"   ✅ HF_HOME: {HF_CACHE_DIR}")
     print(f"   ✅ TRANSFORMERS_CACHE: {HF_CACHE_DIR}/transformers")
     print(f"   ✅ HF_HUB_CACHE: {HF_CACHE_DIR}/hub")
+    print(f"   ✅ PYTORCH_CUDA_ALLOC_CONF: {os.environ['PYTORCH_CUDA_ALLOC_CONF']} (anti-fragmentation)")
+
+
+UNSLOTH_SOURCE = "unsloth[colab-new] @ git+https://github.com/unslothai/unsloth.git"
+
+
+def _installer_cmd():
+    """
+    Command prefix untuk install paket.
+    
+    Pakai uv (Rust resolver, parallel download, hardlink cache) kalau bisa
+    di-bootstrap, fallback ke pip biasa.
+    """
+    try:
+        subprocess.run(
+            [sys.executable, "-m", "pip", "install", "-q", "uv"],
+            check=True
+        )
+        # --python: install ke interpreter yang menjalankan script ini,
+        # bukan python pertama di PATH (yang dipilih --system)
+        return [sys.executable, "-m", "uv", "pip", "install", "--python", sys.executable, "-q"]
+    except subprocess.CalledProcessError:
+        print("   ⚠️ uv tidak tersedia, fallback ke pip")
+        return [sys.executable, "-m", "pip", "install", "-q"]
 
 
 def install_dependencies():
@@ -51,27 +90,15 @@ def install_dependencies():
         "torch", "transformers", "accelerate", "bitsandbytes", 
         "peft", "trl", "datasets", "sentencepiece", "protobuf",
         "huggingface-hub", "wandb", "tensorboard", "psutil", 
-        "pynvml", "pyyaml", "tqdm", "numpy"
+        "pynvml", "pyyaml", "tqdm", "numpy", "hf_transfer"
     ]
     
-    # Install core deps
-    subprocess.run([
-        sys.executable, "-m", "pip", "install", "-q", *core_deps
-    ], check=True)
+    # Core deps + Unsloth (T4 GPU compatible) di-resolve sekali dalam satu
+    # invocation, jadi trl/peft/accelerate/bitsandbytes tidak perlu
+    # re-install --no-deps lagi setelahnya.
+    print("🚀 Installing core dependencies + Unsloth (T4 GPU compatible)...")
+    subprocess.run([*_installer_cmd(), *core_deps, UNSLOTH_SOURCE], check=True)
     print("   ✅ Core dependencies installed")
-    
-    # Install Unsloth (T4 GPU compatible)
-    print("\n🚀 Installing Unsloth (T4 GPU compatible)...")
-    subprocess.run([
-        sys.executable, "-m", "pip", "install", "-q",
-        "unsloth[colab-new] @ git+https://github.com/unslothai/unsloth.git"
-    ], check=True)
-    
-    # Re-install deps tanpa conflicts (untuk T4 older architecture)
-    subprocess.run([
-        sys.executable, "-m", "pip", "install", "-q", "--no-deps",
-        "trl", "peft", "accelerate", "bitsandbytes"
-    ], check=True)
     print("   ✅ Unsloth installed (T4 compatible)")
 
 
@@ -103,13 +130,23 @@ def pre_download_model(model_name: str = DEFAULT_MODEL):
     print(f"\n📥 Pre-downloading model: {model_name}")
     
     try:
+        # hf_transfer (Rust, parallel range requests) harus di-enable sebelum
+        # huggingface_hub di-import; hanya kalau paketnya ada, karena hub
+        # error kalau flag di-set tanpa hf_transfer terinstall.
+        try:
+            import hf_transfer  # noqa: F401
+            os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+        except ImportError:
+            pass
+        
         from huggingface_hub import snapshot_download
         
         # Download model ke cache
         path = snapshot_download(
             repo_id=model_name,
             cache_dir=f"{HF_CACHE_DIR}/hub",
-            ignore_patterns=["*.md", "*.txt"]  # Skip non-essential files
+            allow_patterns=MODEL_ALLOW_PATTERNS,
+            max_workers=8
         )
         print(f"   ✅ Model cached to: {path}")
         return path
@@ -11,6 +11,9 @@ Usage:
     
     # Dengan custom output directory:
     python3 scripts/extract_model.py final_model.zip --output outputs/my_model
+    
+    # Verifikasi isi zip saja, tanpa extract:
+    python3 scripts/extract_model.py final_model.zip --dry-run
 """
 
 import os
@@ -18,6 +21,7 @@ import sys
 import shutil
 import zipfile
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
@@ -27,52 +31,114 @@ def get_project_root():
     return Path(__file__).parent.parent
 
 
-def extract_model(zip_path: Path, output_dir: Path):
-    """Extract model zip ke output directory."""
+EXTRACT_BUFFER_SIZE = 1024 * 1024  # 1 MiB per copy chunk (default extract pakai buffer kecil)
+PARALLEL_MIN_SIZE = 64 * 1024  # File lebih kecil di-extract serial, overhead thread tidak worth it
+
+
+def _extract_member(zipf: zipfile.ZipFile, info: zipfile.ZipInfo, output_root: Path):
+    """Extract satu member zip ke output_root dengan buffer besar."""
+    target = (output_root / info.filename).resolve()
+    if not target.is_relative_to(output_root):
+        print(f"   ⚠️ Skip path di luar target: {info.filename}")
+        return
+    
+    if info.is_dir():
+        target.mkdir(parents=True, exist_ok=True)
+        return
+    
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with zipf.open(info) as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, EXTRACT_BUFFER_SIZE)
+
+
+def extract_model(zip_path: Path, output_dir: Path, dry_run: bool = False) -> int:
+    """
+    Extract model zip ke output directory.
+    
+    Index zip (infolist) dipakai sebagai daftar file yang authoritative,
+    jadi tidak perlu walk ulang output_dir setelah extract.
+    
+    Args:
+        zip_path: Path ke model zip
+        output_dir: Target directory
+        dry_run: Hanya verifikasi isi archive, tidak ada file yang ditulis
+    
+    Returns:
+        Total uncompressed size (bytes) dari file yang di-extract
+    """
     
     if not zip_path.exists():
         print(f"❌ Error: File tidak ditemukan: {zip_path}")
         sys.exit(1)
     
-    # Create output directory
-    output_dir.mkdir(parents=True, exist_ok=True)
-    
-    print(f"📦 Extracting: {zip_path.name}")
-    print(f"📁 Target: {output_dir}")
+    if dry_run:
+        print(f"🔍 Dry run: {zip_path.name} (tidak ada file yang di-extract)")
+    else:
+        # Create output directory
+        output_dir.mkdir(parents=True, exist_ok=True)
+        print(f"📦 Extracting: {zip_path.name}")
+        print(f"📁 Target: {output_dir}")
+    output_root = output_dir.resolve()
     print()
     
+    total_size = 0
+    file_count = 0
+    file_names = set()
+    
     # Extract
     with zipfile.ZipFile(zip_path, 'r') as zipf:
-        file_list = zipf.namelist()
-        print(f"📄 Files in archive ({len(file_list)}):")
+        infos = zipf.infolist()
+        print(f"📄 Files in archive ({len(infos)}):")
         
-        for file in file_list[:10]:  # Show first 10
-            print(f"   - {file}")
+        for info in infos[:10]:  # Show first 10
+            print(f"   - {info.filename}")
         
-        if len(file_list) > 10:
-            print(f"   ... dan {len(file_list) - 10} file lainnya")
+        if len(infos) > 10:
+            print(f"   ... dan {len(infos) - 10} file lainnya")
         
         print()
-        zipf.extractall(output_dir)
-    
-    # Verify extraction
-    extracted_files = list(output_dir.rglob("*"))
-    model_files = [f for f in extracted_files if f.is_file()]
+        large_members = []
+        for info in infos:
+            if not info.is_dir():
+                file_count += 1
+                total_size += info.file_size
+                file_names.add(Path(info.filename).name)
+            
+            if dry_run:
+                continue
+            if info.is_dir() or info.file_size < PARALLEL_MIN_SIZE:
+                _extract_member(zipf, info, output_root)
+            else:
+                large_members.append(info)
+        
+        # Shard besar di-extract paralel (zlib decompress dan file I/O lepas GIL)
+        if large_members:
+            workers = min(len(large_members), os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(
+                    lambda info: _extract_member(zipf, info, output_root),
+                    large_members
+                ))
     
-    print(f"✅ Extracted {len(model_files)} files")
+    print(f"✅ {'Found' if dry_run else 'Extracted'} {file_count} files")
     
     # Check for essential files
     essential_files = ["config.json", "tokenizer_config.json"]
     for efile in essential_files:
-        found = any(efile in str(f) for f in model_files)
+        found = efile in file_names
         status = "✅" if found else "⚠️"
         print(f"   {status} {efile}")
     
-    return output_dir
+    return total_size
 
 
-def show_model_info(model_dir: Path):
-    """Show information about the extracted model."""
+def show_model_info(model_dir: Path, total_size: int = None):
+    """
+    Show information about the extracted model.
+    
+    `model_dir` juga boleh `zipfile.Path` (dry run: baca langsung dari
+    archive), asal total_size sudah diketahui.
+    """
     print("\n" + "=" * 60)
     print("📊 MODEL INFORMATION")
     print("=" * 60)
@@ -81,8 +147,7 @@ def show_model_info(model_dir: Path):
     config_path = model_dir / "config.json"
     if config_path.exists():
         import json
-        with open(config_path) as f:
-            config = json.load(f)
+        config = json.loads(config_path.read_text())
         
         print(f"\n📋 Model Config:")
         print(f"   Model type: {config.get('model_type', 'unknown')}")
@@ -90,13 +155,14 @@ def show_model_info(model_dir: Path):
         print(f"   Hidden size: {config.get('hidden_size', 'unknown')}")
         print(f"   Num layers: {config.get('num_hidden_layers', 'unknown')}")
     
-    # Calculate total size
-    total_size = sum(f.stat().st_size for f in model_dir.rglob("*") if f.is_file())
+    # Calculate total size (pakai size dari zip index kalau sudah ada)
+    if total_size is None:
+        total_size = sum(f.stat().st_size for f in model_dir.rglob("*") if f.is_file())
     size_mb = total_size / (1024 * 1024)
     print(f"\n💾 Total size: {size_mb:.2f} MB")
     
     # List adapter files (LoRA)
-    adapter_files = list(model_dir.glob("adapter_*"))
+    adapter_files = [f for f in model_dir.iterdir() if f.name.startswith("adapter_")]
     if adapter_files:
         print(f"\n🔧 LoRA Adapters found:")
         for af in adapter_files:
@@ -112,10 +178,16 @@ def main():
     )
     parser.add_argument(
         "--output",
-        type=str,
+        type=Path,
         default=None,
         help="Output directory (default: outputs/final_model)"
     )
+    parser.add_argument(
+        "--dry-run",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Verifikasi isi zip (file count, essential files, config) tanpa extract"
+    )
     args = parser.parse_args()
     
     project_root = get_project_root()
@@ -137,9 +209,9 @@ def main():
     
     # Set output directory
     if args.output:
-        output_dir = Path(args.output)
+        output_dir = args.output
         if not output_dir.is_absolute():
-            output_dir = project_root / args.output
+            output_dir = project_root / output_dir
     else:
         # Default: outputs/final_model_YYYYMMDD_HHMMSS
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -150,10 +222,15 @@ def main():
     print("=" * 60)
     
     # Extract
-    extract_model(zip_path, output_dir)
+    total_size = extract_model(zip_path, output_dir, dry_run=args.dry_run)
     
     # Show info
-    show_model_info(output_dir)
+    if args.dry_run:
+        show_model_info(zipfile.Path(zip_path), total_size)
+        print("\n🔍 Dry run selesai, tidak ada file yang di-extract.")
+        return
+    
+    show_model_info(output_dir, total_size)
     
     print("\n" + "=" * 60)
     print("🎉 EXTRACTION COMPLETE!")
@@ -586,8 +586,8 @@ def create_notebook():
         "outputs": [],
         "source": [
             "# ===== SETUP MIXED PRECISION =====\n",
-            "bf16_support, fp16_support, precision_mode = setup_mixed_precision()\n",
-            "print(f'📊 Precision mode: {precision_mode}')\n",
+            "bf16_support, fp16_support, precision_mode, tf32_enabled = setup_mixed_precision()\n",
+            "print(f'📊 Precision mode: {precision_mode} (TF32: {tf32_enabled})')\n",
             "\n",
             "# ===== LOAD TOKENIZER & ANALYZE DATASET =====\n",
             "print(f'\\n📝 Loading tokenizer: {MODEL_NAME}')\n",
@@ -715,6 +715,7 @@ def create_notebook():
             "    # Mixed precision\n",
             "    bf16=bf16_support,\n",
             "    fp16=fp16_support,\n",
+            "    tf32=tf32_enabled or None,\n",
             "    \n",
             "    # Optimizer\n",
             "    optim='paged_adamw_8bit',\n",
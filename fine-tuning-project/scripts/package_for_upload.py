@@ -16,12 +16,19 @@ Usage:
 """
 
 import os
+import io
 import sys
-import shutil
 import zipfile
 import argparse
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# ===== KONSTANTA =====
+READ_BUFFER_SIZE = 256 * 1024  # 256 KiB
+SRC_COMPRESS_LEVEL = 1  # Deflate level 1: jauh lebih cepat, ukuran hampir sama untuk source .py
+EXCLUDED_DIRS = frozenset({"__pycache__", ".ipynb_checkpoints"})
+EXCLUDED_SUFFIXES = (".pyc",)
 
 
 def get_project_root():
@@ -29,8 +36,26 @@ def get_project_root():
     return Path(__file__).parent.parent
 
 
-def create_src_zip(project_root: Path, output_path: Path):
-    """Create zip dari folder src/."""
+def _iter_src_files(directory: Path):
+    """Yield semua file di bawah directory (rekursif), skip EXCLUDED_DIRS dan EXCLUDED_SUFFIXES."""
+    with os.scandir(directory) as it:
+        for entry in it:
+            # d_type dari scandir sudah cukup, tidak perlu stat per entry
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in EXCLUDED_DIRS:
+                    yield from _iter_src_files(Path(entry.path))
+            elif not entry.name.endswith(EXCLUDED_SUFFIXES):
+                yield Path(entry.path)
+
+
+def _read_file(file_path: Path) -> bytes:
+    """Baca isi file dengan buffer besar."""
+    with open(file_path, 'rb', buffering=READ_BUFFER_SIZE) as f:
+        return f.read()
+
+
+def create_src_zip(project_root: Path) -> bytes:
+    """Create zip dari folder src/ (in-memory)."""
     src_dir = project_root / "src"
     
     if not src_dir.exists():
@@ -39,48 +64,70 @@ def create_src_zip(project_root: Path, output_path: Path):
     
     print(f"📦 Creating src.zip...")
     
-    # Create zip
-    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(src_dir):
-            # Skip __pycache__ directories
-            dirs[:] = [d for d in dirs if d != '__pycache__']
-            
-            for file in files:
-                if file.endswith('.pyc'):
-                    continue
-                    
-                file_path = Path(root) / file
+    files = sorted(_iter_src_files(src_dir))
+    buffer = io.BytesIO()
+    
+    # Baca file secara paralel (I/O bound), tulis ke zip secara serial
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        contents = executor.map(_read_file, files)
+        
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED,
+                             compresslevel=SRC_COMPRESS_LEVEL) as zipf:
+            for file_path, data in zip(files, contents):
                 arcname = file_path.relative_to(project_root)
-                zipf.write(file_path, arcname)
-                print(f"   + {arcname}")
+                zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+                zipf.writestr(zinfo, data, compresslevel=SRC_COMPRESS_LEVEL)
+    
+    print(f"   + {len(files)} files")
     
-    size_kb = output_path.stat().st_size / 1024
+    src_zip = buffer.getvalue()
+    size_kb = len(src_zip) / 1024
     print(f"   ✅ src.zip created ({size_kb:.1f} KB)")
-    return output_path
+    return src_zip
 
 
-def package_dataset(dataset_path: Path, output_dir: Path):
-    """Copy dataset ke output directory."""
+def check_dataset(dataset_path: Path):
+    """Pastikan dataset ada sebelum output package dibuka/ditulis."""
     if not dataset_path.exists():
         print(f"❌ Error: Dataset tidak ditemukan: {dataset_path}")
         sys.exit(1)
+
+
+def package_dataset(dataset_path: Path, zipf: zipfile.ZipFile):
+    """Tulis dataset langsung dari source path ke package."""
+    zipf.write(dataset_path, dataset_path.name)
     
-    output_path = output_dir / dataset_path.name
-    shutil.copy2(dataset_path, output_path)
-    
-    size_kb = output_path.stat().st_size / 1024
-    print(f"📄 Dataset copied: {dataset_path.name} ({size_kb:.1f} KB)")
-    return output_path
+    size_kb = dataset_path.stat().st_size / 1024
+    print(f"📄 Dataset added: {dataset_path.name} ({size_kb:.1f} KB)")
 
 
-def create_final_package(temp_dir: Path, output_path: Path):
-    """Create final upload package."""
-    print(f"\n📦 Creating final package: {output_path.name}")
+def create_final_package(project_root: Path, dataset_path: Path, output_path: Path):
+    """
+    Create final upload package dalam satu pass.
+    
+    src.zip dibuat in-memory dan file lain ditulis langsung dari source path,
+    tanpa staging directory sementara. Semua validasi (dataset, src/)
+    dilakukan sebelum output dibuka, jadi error tidak meninggalkan package
+    setengah jadi.
+    """
+    print(f"📦 Creating final package: {output_path.name}\n")
+    
+    check_dataset(dataset_path)
+    src_zip = create_src_zip(project_root)
     
     with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for file in temp_dir.iterdir():
-            zipf.write(file, file.name)
-            print(f"   + {file.name}")
+        # 1. src.zip (sudah deflated, jadi cukup di-store tanpa kompresi ulang)
+        zipf.writestr("src.zip", src_zip, compress_type=zipfile.ZIP_STORED)
+        
+        # 2. Dataset
+        package_dataset(dataset_path, zipf)
+        
+        # 3. Notebook
+        notebook_path = project_root / "notebooks" / "training.ipynb"
+        if notebook_path.exists():
+            zipf.write(notebook_path, notebook_path.name)
+            print(f"📓 Notebook added: {notebook_path.name}")
     
     size_mb = output_path.stat().st_size / (1024 * 1024)
     print(f"\n✅ Package created: {output_path}")
@@ -114,40 +161,16 @@ def main():
     print(f"📄 Dataset: {dataset_path}")
     print(f"📦 Output: {output_path}\n")
     
-    # Create temp directory
-    temp_dir = project_root / ".temp_package"
-    temp_dir.mkdir(exist_ok=True)
+    create_final_package(project_root, dataset_path, output_path)
     
-    try:
-        # 1. Create src.zip
-        src_zip = temp_dir / "src.zip"
-        create_src_zip(project_root, src_zip)
-        
-        # 2. Copy dataset
-        package_dataset(dataset_path, temp_dir)
-        
-        # 3. Copy notebook
-        notebook_path = project_root / "notebooks" / "training.ipynb"
-        if notebook_path.exists():
-            shutil.copy2(notebook_path, temp_dir / "training.ipynb")
-            print(f"📓 Notebook copied: training.ipynb")
-        
-        # 4. Create final package
-        create_final_package(temp_dir, output_path)
-        
-        print("\n" + "=" * 60)
-        print("🎉 PACKAGING COMPLETE!")
-        print("=" * 60)
-        print("\n📋 Next steps:")
-        print("   1. Buka Google Colab atau VS Code")
-        print("   2. Upload file: upload_package.zip")
-        print("   3. Extract dan jalankan notebook")
-        print(f"\n📁 File lokasi: {output_path}")
-        
-    finally:
-        # Cleanup temp directory
-        shutil.rmtree(temp_dir, ignore_errors=True)
-
+    print("\n" + "=" * 60)
+    print("🎉 PACKAGING COMPLETE!")
+    print("=" * 60)
+    print("\n📋 Next steps:")
+    print("   1. Buka Google Colab atau VS Code")
+    print("   2. Upload file: upload_package.zip")
+    print("   3. Extract dan jalankan notebook")
+    print(f"\n📁 File lokasi: {output_path}")
 
 if __name__ == "__main__":
     main()
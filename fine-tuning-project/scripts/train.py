@@ -17,6 +17,7 @@ import torch
 import os
 import sys
 import argparse
+import functools
 from pathlib import Path
 
 # Add src to path
@@ -26,7 +27,7 @@ from datasets import load_dataset
 from transformers import AutoTokenizer, TrainingArguments, DataCollatorForLanguageModeling
 
 # Import our modules
-from src.data.dataset_analyzer import analyze_dataset_and_configure
+from src.data.dataset_analyzer import analyze_dataset_and_configure, get_config_cache_path
 from src.data.dataset_splitter import split_dataset, analyze_split_distribution
 from src.training.mixed_precision import setup_mixed_precision
 from src.training.callbacks import (
@@ -35,7 +36,7 @@ from src.training.callbacks import (
     EarlyStoppingCallback,
     ValidationLossLoggerCallback,
 )
-from src.training.metrics import compute_perplexity_only
+from src.training.metrics import compute_perplexity_only, preprocess_logits_for_metrics
 from src.models.lora_config import get_dynamic_lora_config
 
 
@@ -84,10 +85,16 @@ def parse_args():
         default="qwen3-finetuning",
         help="Weights & Biases project name"
     )
+    parser.add_argument(
+        "--no_config_cache",
+        action="store_true",
+        help="Re-analyze the dataset even if a cached dynamic config exists"
+    )
     return parser.parse_args()
 
 
 def main():
+    global USE_WANDB  # reset below if wandb login fails
     args = parse_args()
     
     print("=" * 80)
@@ -95,7 +102,7 @@ def main():
     print("=" * 80)
     
     # ===== 1. MIXED PRECISION SETUP =====
-    bf16_support, fp16_support, precision_mode = setup_mixed_precision()
+    bf16_support, fp16_support, precision_mode, tf32_enabled = setup_mixed_precision()
     
     # ===== 2. LOAD DATASET =====
     print(f"\n📥 Loading dataset from: {args.dataset}")
@@ -125,12 +132,19 @@ def main():
         tokenizer.add_special_tokens({'pad_token': '[PAD]'})
     
     # ===== 5. ANALYZE DATASET (TRAIN SET ONLY!) =====
+    # Cached per dataset file (path + size + mtime) so unchanged datasets skip re-analysis
+    config_cache_path = None if args.no_config_cache else get_config_cache_path(
+        args.dataset, MODEL_NAME, 32768, VRAM_GB
+    )
     train_dataset, dynamic_config = analyze_dataset_and_configure(
         dataset_dict["train"], 
         tokenizer, 
         max_length=32768, 
-        vram_gb=VRAM_GB
+        vram_gb=VRAM_GB,
+        cache_path=config_cache_path
     )
+    # Reuse the 'text'-augmented train split so it is not re-formatted below
+    dataset_dict["train"] = train_dataset
     
     # Analyze distribution for each split
     analyze_split_distribution(dataset_dict, tokenizer)
@@ -219,7 +233,6 @@ def main():
             os.environ["WANDB_PROJECT"] = args.wandb_project
             print(f"✅ Weights & Biases enabled: {args.wandb_project}")
         except:
-            global USE_WANDB
             USE_WANDB = False
             print("⚠️  W&B login failed, using TensorBoard only")
     
@@ -238,6 +251,7 @@ def main():
         # Mixed precision
         bf16=bf16_support,
         fp16=fp16_support,
+        tf32=tf32_enabled or None,  # None: leave backend flags untouched
         
         # Optimizer
         optim="paged_adamw_8bit",
@@ -282,6 +296,10 @@ def main():
         ValidationLossLoggerCallback(),
     ]
     
+    # Each eval batch is reduced on device to (loss sum, token count);
+    # no argmax since only perplexity is reported
+    perplexity_preprocess = functools.partial(preprocess_logits_for_metrics, with_accuracy=False)
+    
     # ===== 12. TRAINER =====
     try:
         from trl import SFTTrainer
@@ -293,6 +311,7 @@ def main():
             data_collator=data_collator,
             callbacks=callbacks,
             compute_metrics=compute_perplexity_only,
+            preprocess_logits_for_metrics=perplexity_preprocess,
             dataset_text_field="text",
             max_seq_length=dynamic_config["max_seq_length"],
             packing=False,
@@ -308,6 +327,7 @@ def main():
             data_collator=data_collator,
             callbacks=callbacks,
             compute_metrics=compute_perplexity_only,
+            preprocess_logits_for_metrics=perplexity_preprocess,
         )
         print("✅ Using Trainer from transformers")
     
@@ -1,12 +1,16 @@
 # src/data/__init__.py
 """Data processing modules"""
 
-from .dataset_analyzer import analyze_dataset_and_configure, estimate_vram_usage
+from .dataset_analyzer import analyze_dataset_and_configure, get_config_cache_path
 from .dataset_splitter import split_dataset, analyze_split_distribution
+from ._text_format import format_messages_to_text, format_messages_array, format_messages_column
 
 __all__ = [
     "analyze_dataset_and_configure",
-    "estimate_vram_usage",
+    "get_config_cache_path",
     "split_dataset",
     "analyze_split_distribution",
+    "format_messages_to_text",
+    "format_messages_array",
+    "format_messages_column",
 ]
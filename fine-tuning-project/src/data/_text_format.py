@@ -0,0 +1,59 @@
+"""
+Shared messages -> text formatting used by the analyzer and the splitter.
+"""
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def format_messages_to_text(messages, _get=dict.get):
+    """
+    Converts a list of message dictionaries into a single string for tokenization.
+    Assumes message format: [{"role": "system|user|assistant", "content": "..."}]
+    Handles cases where messages might be empty or None.
+    """
+    if not messages:
+        return ""
+
+    # Single generator pass, no intermediate list; role defaults to "user".
+    # _get is bound once as a default arg to skip the per-message .get lookup.
+    return "\n".join(
+        "%s: %s" % (_get(msg, "role", "user"), _get(msg, "content", ""))
+        for msg in messages
+    )
+
+
+def format_messages_array(messages):
+    """
+    Formats a 'messages' Arrow array into a string array with PyArrow compute
+    kernels, so there is no per-row Python work and no worker processes.
+    Returns None if 'messages' is not list<struct<role: string, content: string>>;
+    the caller then falls back to format_messages_to_text.
+    """
+    if isinstance(messages, pa.ChunkedArray):
+        messages = messages.combine_chunks()
+    elif messages.offset:
+        # Sliced array: ListArray.from_arrays can't take a null mask together
+        # with sliced offsets, so copy it into a zero-offset array first
+        messages = pa.concat_arrays([messages])
+    if not pa.types.is_list(messages.type) or not pa.types.is_struct(messages.type.value_type):
+        return None
+    message_type = messages.type.value_type
+    for field_name in ("role", "content"):
+        if message_type.get_field_index(field_name) < 0 or not pa.types.is_string(message_type.field(field_name).type):
+            return None
+
+    # One "role: content" line per message, over the flattened child array
+    values = messages.values
+    role = pc.fill_null(pc.struct_field(values, "role"), "user")
+    content = pc.fill_null(pc.struct_field(values, "content"), "")
+    lines = pc.binary_join_element_wise(role, content, ": ")
+
+    # Re-nest per conversation and join; empty/null conversations -> ""
+    conversations = pa.ListArray.from_arrays(messages.offsets, lines, mask=messages.is_null())
+    return pc.fill_null(pc.binary_join(conversations, "\n"), "")
+
+
+def format_messages_column(dataset):
+    """Builds the 'text' column for a whole dataset; see format_messages_array."""
+    return format_messages_array(dataset.with_format("arrow")[:]["messages"])
@@ -1,58 +1,110 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
 
-def _format_messages_to_text(messages):
+import numpy as np
+import pyarrow as pa
+
+from ._text_format import format_messages_to_text, format_messages_array
+
+CONFIG_CACHE_DIR = Path.home() / ".cache" / "finetune"
+
+
+def get_config_cache_path(dataset_path, *key_parts):
     """
-    Converts a list of message dictionaries into a single string for tokenization.
-    Assumes message format: [{"role": "system|user|assistant", "content": "..."}]
-    Handles cases where messages might be empty or None.
+    Returns the dynamic_config cache file for a dataset file.
+    Keyed on path + size + mtime (no content hashing) plus any extra settings
+    that change the result (model name, max_length, VRAM, ...).
     """
-    if not messages:
-        return ""
+    stat = os.stat(dataset_path)
+    key = ":".join(
+        str(part) for part in (os.path.abspath(dataset_path), stat.st_size, stat.st_mtime_ns, *key_parts)
+    )
+    return CONFIG_CACHE_DIR / "{}.json".format(hashlib.sha1(key.encode()).hexdigest())
+
 
-    formatted_text = []
-    for msg in messages:
-        role = msg.get("role", "user") # Default to user if role not specified
-        content = msg.get("content", "")
-        formatted_text.append(f"{role}: {content}")
-    return "\n".join(formatted_text)
+def _write_config_cache(cache_path, dynamic_config):
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(dynamic_config, f)
+    os.replace(tmp_path, cache_path)  # Atomic: never leave a half-written cache file
 
-def analyze_dataset_and_configure(dataset, tokenizer, max_length=1024, vram_gb=16.0):
+
+def analyze_dataset_and_configure(dataset, tokenizer, max_length=1024, vram_gb=16.0, cache_path=None):
     print("🔍 Analyzing dataset...")
     print(f"   Initial dataset columns: {dataset.column_names}")
 
     # Ensure 'messages' column exists. If not, can't proceed with this strategy.
-    if 'messages' not in dataset.column_names:
+    # Checked once up front on the schema; the map below always produces 'text'.
+    if 'messages' not in dataset.features:
         raise ValueError("Dataset does not contain a 'messages' column. This script expects conversational data.")
 
     # Always ensure 'text' is generated from 'messages' for consistency
-    # This proactively creates/overwrites 'text' if 'messages' exists
-    print("   Proactively converting 'messages' to 'text' for length analysis...")
-    dataset = dataset.map(
-        lambda x: {"text": _format_messages_to_text(x.get("messages", []))},
-        num_proc=os.cpu_count() // 2 or 1,
-        desc="Formatting messages to text",
-        load_from_cache_file=False # Force recomputation
-    )
+    # This proactively creates/overwrites 'text' if 'messages' exists.
+    # Text formatting and token lengths are computed in one fused batched
+    # pass, so the Arrow table is read and rewritten once instead of twice.
+    # With a cached dynamic_config only 'text' is needed, so tokenization is skipped.
+    cached_config = None
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cached_config = json.load(f)
+        print(f"   Using cached dynamic config: {cache_path}")
+    with_length = cached_config is None
+
+    if with_length:
+        print("   Proactively converting 'messages' to 'text' and calculating token lengths...")
+    else:
+        print("   Proactively converting 'messages' to 'text'...")
+
+    def _text_and_length(batch, with_length):
+        text = format_messages_array(batch["messages"])
+        if text is None:
+            text = pa.array(
+                [format_messages_to_text(m) for m in batch["messages"].to_pylist()],
+                type=pa.string(),
+            )
+        # An Arrow-formatted map replaces the whole batch, so keep the input columns.
+        if "text" in batch.column_names:
+            batch = batch.drop_columns(["text"])
+        batch = batch.append_column("text", text)
+        if not with_length:
+            return batch
+        # One fast (Rust) tokenizer call per batch; only the lengths are kept
+        lengths = tokenizer(
+            text.to_pylist(),
+            add_special_tokens=False,
+            return_length=True,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )["length"]
+        # 'length' is int32 (Arrow would infer int64 from Python ints)
+        return batch.append_column("length", pa.array(lengths, type=pa.int32()))
+
+    # num_proc=1 because the Rust tokenizer is already parallel and releases the GIL.
+    dataset = dataset.with_format("arrow").map(
+        _text_and_length,
+        batched=True,
+        batch_size=1000,
+        num_proc=1,
+        fn_kwargs={"with_length": with_length},
+        desc="Formatting messages and calculating token lengths" if with_length else "Formatting messages to text",
+    ).with_format(None)
     print("   Conversion complete.")
     print(f"   Dataset columns after 'messages' to 'text' conversion: {dataset.column_names}")
 
-    # Final check: 'text' column MUST exist at this point.
-    if 'text' not in dataset.column_names:
-        raise ValueError("FATAL: 'text' column was not created by the 'messages' conversion. Please check your dataset structure.")
-
-    # Tokenize and calculate lengths
-    print(f"   Columns before token length calculation: {dataset.column_names}")
-    dataset = dataset.map(
-        lambda x: {"length": len(tokenizer.encode(x["text"], add_special_tokens=False))},
-        num_proc=os.cpu_count() // 2 or 1,
-        desc="Calculating token lengths",
-        load_from_cache_file=False # Force recomputation
-    )
-    print(f"   Columns after token length calculation: {dataset.column_names}")
-
+    if cached_config is not None:
+        return dataset, cached_config
 
     # Find the 95th percentile length
-    lengths = sorted(dataset["length"])
-    p95_length = lengths[int(len(lengths) * 0.95)]
+    # NumPy view over the Arrow int32 column (no Python list of boxed ints),
+    # then np.partition (quickselect, O(n)) instead of a full sort
+    lengths = dataset.with_format("numpy", columns=["length"])[:]["length"]
+    p95_index = int(len(lengths) * 0.95)
+    p95_length = int(np.partition(lengths, p95_index)[p95_index])
     print(f"   95th percentile token length: {p95_length:,}")
 
     # Determine max_seq_length
@@ -94,4 +146,8 @@ def analyze_dataset_and_configure(dataset, tokenizer, max_length=1024, vram_gb=1
     print(f"   Effective Batch Size: {dynamic_config['effective_batch_size']}")
     print(f"   Using Gradient Checkpointing: {dynamic_config['use_gradient_checkpointing']}")
 
+    if cache_path is not None:
+        # Written in the background; non-daemon so it still finishes if training exits first
+        threading.Thread(target=_write_config_cache, args=(cache_path, dynamic_config)).start()
+
     return dataset, dynamic_config
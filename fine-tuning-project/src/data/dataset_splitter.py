@@ -1,7 +1,9 @@
 
-import os
+import numpy as np
 from datasets import Dataset
 
+from ._text_format import format_messages_to_text, format_messages_column
+
 def split_dataset(dataset, train_ratio, val_ratio, test_ratio, seed=42):
     print("📊 Dataset Splitting:")
     total_samples = len(dataset)
@@ -12,16 +14,16 @@ def split_dataset(dataset, train_ratio, val_ratio, test_ratio, seed=42):
 
     assert abs(train_ratio + val_ratio + test_ratio - 1.0) < 1e-6, "Ratios must sum to 1.0"
 
-    # First split into train_val and test
-    train_val_ratio = train_ratio + val_ratio
-    train_val_dataset, test_dataset = dataset.train_test_split(
-        test_size=test_ratio, seed=seed
-    ).values()
+    # Single shuffled permutation + index selects instead of two
+    # train_test_split calls (each of which shuffles and copies the table)
+    rng = np.random.default_rng(seed)
+    perm = rng.permutation(total_samples)
+    n_test = int(total_samples * test_ratio)
+    n_val = int(total_samples * val_ratio)
 
-    # Then split train_val into train and validation
-    train_dataset, val_dataset = train_val_dataset.train_test_split(
-        test_size=val_ratio / train_val_ratio, seed=seed
-    ).values()
+    test_dataset = dataset.select(perm[:n_test])
+    val_dataset = dataset.select(perm[n_test:n_test + n_val])
+    train_dataset = dataset.select(perm[n_test + n_val:])
 
     print("\n✅ Dataset Split Complete:")
     print("   Train: {} samples ({:.1f}%)".format(len(train_dataset), len(train_dataset)/total_samples*100))
@@ -35,43 +37,50 @@ def split_dataset(dataset, train_ratio, val_ratio, test_ratio, seed=42):
     }
 
 
-def _format_messages_to_text(messages):
+def _token_lengths(texts, tokenizer, batch_size=1000):
     """
-    Converts a list of message dictionaries into a single string for tokenization.
-    Assumes message format: [{"role": "system|user|assistant", "content": "..."}]
-    Handles cases where messages might be empty or None.
+    Tokenizes texts in batches and returns only the token counts.
+    return_length=True lets the fast tokenizer report lengths without
+    building attention masks / token type ids we never use.
+    Duplicate texts (boilerplate prompts, repeated samples) are tokenized once.
     """
-    if not messages:
-        return ""
-
-    formatted_text = []
-    for msg in messages:
-        role = msg.get("role", "user") # Default to user if role not specified
-        content = msg.get("content", "")
-        formatted_text.append("{}: {}".format(role, content))
-    return "\n".join(formatted_text)
+    unique_texts = list(dict.fromkeys(texts))
+    unique_lengths = []
+    for start in range(0, len(unique_texts), batch_size):
+        out = tokenizer(
+            unique_texts[start:start + batch_size],
+            add_special_tokens=False,
+            return_length=True,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        unique_lengths.extend(out["length"])
+    length_by_text = dict(zip(unique_texts, unique_lengths))
+    return [length_by_text[text] for text in texts]
 
 
 def analyze_split_distribution(dataset_dict, tokenizer):
     print("\n📊 Analyzing token length distribution across splits:")
     for split_name, dataset in dataset_dict.items():
         print("   Initial columns for {}: {}".format(split_name, dataset.column_names))
-        # Always ensure 'text' is generated from 'messages' for consistency
-        if 'messages' in dataset.column_names:
-            temp_dataset = dataset.map(
-                lambda x: {"text": _format_messages_to_text(x.get("messages", []))},
-                num_proc=os.cpu_count() // 2 or 1,
-                desc="Formatting messages for {}".format(split_name),
-                load_from_cache_file=False # Force recomputation
-            )
-            print("   Columns after 'messages' to 'text' conversion for {}: {}".format(split_name, temp_dataset.column_names))
-            # Final check to ensure 'text' column exists in temp_dataset before processing
-            if 'text' not in temp_dataset.column_names:
-                print("   WARNING: 'text' column not found in {} after messages conversion. Skipping length analysis for this split.".format(split_name))
-                continue
-            lengths = [len(tokenizer.encode(x["text"], add_special_tokens=False)) for x in temp_dataset]
-        elif 'text' in dataset.column_names:
-            lengths = [len(tokenizer.encode(x["text"], add_special_tokens=False)) for x in dataset]
+        # Schema checked once up front; the messages->text map always produces 'text'.
+        has_text = 'text' in dataset.features
+        has_messages = 'messages' in dataset.features
+        # Reuse an existing 'text' column (e.g. the train split returned by
+        # analyze_dataset_and_configure) instead of re-formatting 'messages'
+        if has_text:
+            lengths = _token_lengths(dataset["text"], tokenizer)
+        elif has_messages:
+            text_column = format_messages_column(dataset)
+            if text_column is not None:
+                texts = text_column.to_pylist()
+            else:
+                texts = dataset.map(
+                    lambda x: {"text": format_messages_to_text(x.get("messages", []))},
+                    num_proc=1,
+                    desc="Formatting messages for {}".format(split_name),
+                )["text"]
+            lengths = _token_lengths(texts, tokenizer)
         else:
             print("   Skipping {} due to missing 'text' or 'messages' column.".format(split_name))
             continue
@@ -79,7 +88,8 @@ def analyze_split_distribution(dataset_dict, tokenizer):
         if not lengths:
             print("   {} (0 samples)".format(split_name))
             continue
-        avg_len = sum(lengths) / len(lengths)
-        max_len = max(lengths)
-        min_len = min(lengths)
+        lengths = np.asarray(lengths, dtype=np.int32)
+        avg_len = lengths.mean()
+        max_len = lengths.max()
+        min_len = lengths.min()
         print("   {}: Avg Length={:.0f}, Max Length={}, Min Length={} ({} samples)".format(split_name, avg_len, max_len, min_len, len(dataset)))
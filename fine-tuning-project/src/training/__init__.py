@@ -8,7 +8,11 @@ from .callbacks import (
     ValidationLossLoggerCallback,
 )
 from .mixed_precision import setup_mixed_precision
-from .metrics import compute_metrics, compute_perplexity_only
+from .metrics import (
+    compute_metrics,
+    compute_perplexity_only,
+    preprocess_logits_for_metrics,
+)
 
 __all__ = [
     "VRAMMonitorCallback",
@@ -18,4 +22,5 @@ __all__ = [
     "setup_mixed_precision",
     "compute_metrics",
     "compute_perplexity_only",
+    "preprocess_logits_for_metrics",
 ]
@@ -8,32 +8,144 @@ Reference:
 - https://www.runpod.io/articles/guides/avoid-oom-crashes-for-large-models
 """
 
+import os
+import atexit
+import functools
+
+from ..utils.cuda_alloc import CUDA_ALLOC_CONF
+
+# Let the caching allocator grow expandable segments instead of fragmenting.
+# Must be set before the first CUDA allocation; an explicit user value wins.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", CUDA_ALLOC_CONF)
+
+import math
+import queue
+import threading
 import torch
-import gc
+from collections import deque
 from typing import Dict
 from transformers import TrainerCallback, TrainingArguments, TrainerState, TrainerControl
-import numpy as np
 
-# Try to import pynvml for VRAM monitoring
+# Try to import pynvml for VRAM monitoring (NVML itself is initialised lazily)
 try:
     import pynvml
-    pynvml.nvmlInit()
     NVML_AVAILABLE = True
-except:
+except ImportError:
+    pynvml = None
     NVML_AVAILABLE = False
     print("⚠️  pynvml not available, VRAM monitoring disabled")
 
 
+@functools.lru_cache(maxsize=1)
+def _get_nvml_handle():
+    """
+    NVML handle for GPU 0, initialising NVML on first use.
+    
+    Keeps the driver call out of import time (CPU-only runs never pay it).
+    Returns None if NVML is unavailable.
+    """
+    if not NVML_AVAILABLE:
+        return None
+    try:
+        pynvml.nvmlInit()
+    except pynvml.NVMLError:
+        return None
+    atexit.register(pynvml.nvmlShutdown)
+    try:
+        return pynvml.nvmlDeviceGetHandleByIndex(0)
+    except pynvml.NVMLError:
+        return None
+
+
+class _BackgroundLogWriter:
+    """
+    Print VRAM log records from a daemon thread, batched about once a second.
+    
+    The training thread only enqueues raw (step, reserved, peak, total) tuples, so
+    formatting and the (possibly slow, e.g. Colab websocket) stdout flush
+    never land on a training step. `flush()` stops the thread after it has
+    printed everything queued so far; the next `put()` starts a new one.
+    """
+    _STOP = object()
+    
+    def __init__(self, flush_interval: float = 1.0):
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopping = None
+    
+    def put(self, record):
+        if self._thread is None:
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._queue.put_nowait(record)
+    
+    def _drain(self, records):
+        """Print `records` plus everything queued; True if the stop sentinel was reached."""
+        stop = False
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is self._STOP:
+                stop = True
+                break
+            records.append(record)
+        if records:
+            print("\n".join(
+                f"💾 VRAM (step {step}): {reserved / 1e9:.2f}GB / {total / 1e9:.2f}GB reserved "
+                f"({reserved / total * 100:.1f}%), peak allocated {peak / 1e9:.2f}GB"
+                for step, reserved, peak, total in records
+            ), flush=True)
+        return stop
+    
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is self._STOP:
+                return
+            self._stopping.wait(self.flush_interval)  # let a batch accumulate (flush() cuts this short)
+            if self._drain([first]):
+                return
+    
+    def flush(self):
+        """Print all pending records, in order, before returning."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._queue.put_nowait(self._STOP)
+        self._thread.join()
+        self._thread = None
+
+
 class VRAMMonitorCallback(TrainerCallback):
     """
     Monitor VRAM usage and trigger early warning if approaching OOM.
     
+    VRAM is only sampled every `log_every_n_steps` steps (or every step while
+    an exponential moving average says usage is near the threshold). The
+    signal is PyTorch's own reservation (torch.cuda.memory_reserved()), so
+    other processes on a shared GPU don't cause false alarms; NVML is read
+    near the threshold only to add any growth of the non-PyTorch share
+    since the first sample.
+    
     Args:
         threshold_percent: VRAM usage percentage to trigger warning
+        log_every_n_steps: Sampling/logging interval in steps
+        ema_alpha: Smoothing factor for the usage moving average
     """
-    def __init__(self, threshold_percent: float = 95.0):
+    def __init__(self, threshold_percent: float = 95.0, log_every_n_steps: int = 50, ema_alpha: float = 0.3):
         self.threshold_percent = threshold_percent
+        self.log_every_n_steps = log_every_n_steps
+        self.ema_alpha = ema_alpha
         self.oom_warning_shown = False
+        self._used_percent_ema = None
+        self._near_threshold = False
+        self._log_writer = _BackgroundLogWriter()
+        self._total_memory = None
+        self._other_baseline = None  # Non-PyTorch bytes (context, other processes) at first sample
         
     def on_step_end(
         self, 
@@ -42,24 +154,46 @@ class VRAMMonitorCallback(TrainerCallback):
         control: TrainerControl, 
         **kwargs
     ):
-        if not NVML_AVAILABLE or not torch.cuda.is_available():
+        if not torch.cuda.is_available():
+            return control
+        
+        is_log_step = state.global_step % self.log_every_n_steps == 0
+        if not is_log_step and not self._near_threshold:
             return control
         
         try:
-            handle = pynvml.nvmlDeviceGetHandleByIndex(0)
-            mem_info = pynvml.nvmlDeviceGetMemoryInfo(handle)
-            used_percent = (mem_info.used / mem_info.total) * 100
+            if self._total_memory is None:
+                self._total_memory = torch.cuda.get_device_properties(torch.cuda.current_device()).total_memory
+            total = self._total_memory
+            reserved = torch.cuda.memory_reserved()
+            used_percent = (reserved / total) * 100
+            
+            # Smooth single noisy samples before deciding we're near OOM
+            if self._used_percent_ema is None:
+                self._used_percent_ema = used_percent
+            else:
+                self._used_percent_ema += self.ema_alpha * (used_percent - self._used_percent_ema)
+            self._near_threshold = self._used_percent_ema > self.threshold_percent - 5
+            
+            # Log every N steps (formatted and printed off the training thread).
+            # Peak allocated vs reserved separates real usage from fragmentation.
+            if is_log_step:
+                self._log_writer.put((state.global_step, reserved, torch.cuda.max_memory_allocated(), total))
             
-            # Log every 50 steps
-            if state.global_step % 50 == 0:
-                print(f"💾 VRAM: {mem_info.used / 1e9:.2f}GB / {mem_info.total / 1e9:.2f}GB ({used_percent:.1f}%)")
+            # NVML only to see whether the non-PyTorch share has grown
+            handle = _get_nvml_handle() if self._other_baseline is None or self._near_threshold else None
+            if handle is not None:
+                other = pynvml.nvmlDeviceGetMemoryInfo(handle).used - reserved
+                if self._other_baseline is None:
+                    self._other_baseline = other
+                used_percent = ((reserved + max(0, other - self._other_baseline)) / total) * 100
             
-            # OOM Prevention
+            # OOM Prevention: checkpoint instead of empty_cache(), which forces
+            # a device sync and makes the next allocations go back to cudaMalloc
             if used_percent > self.threshold_percent and not self.oom_warning_shown:
                 print(f"\n⚠️  CRITICAL: VRAM usage at {used_percent:.1f}%!")
-                print("   Clearing cache to prevent OOM...")
-                gc.collect()
-                torch.cuda.empty_cache()
+                print("   Requesting checkpoint save in case of OOM...")
+                control.should_save = True
                 self.oom_warning_shown = True
                 
             # Reset warning after VRAM drops
@@ -70,6 +204,16 @@ class VRAMMonitorCallback(TrainerCallback):
             pass  # Silence errors to not interrupt training
             
         return control
+    
+    def on_train_end(
+        self, 
+        args: TrainingArguments, 
+        state: TrainerState, 
+        control: TrainerControl, 
+        **kwargs
+    ):
+        self._log_writer.flush()
+        return control
 
 
 class DynamicConfigCallback(TrainerCallback):
@@ -138,11 +282,16 @@ class EarlyStoppingCallback(TrainerCallback):
 
 
 class ValidationLossLoggerCallback(TrainerCallback):
-    """Log validation loss and perplexity at each evaluation."""
+    """
+    Log validation loss and perplexity at each evaluation.
+    
+    Args:
+        history_size: Number of recent evaluations kept in memory
+    """
     
-    def __init__(self):
-        self.validation_losses = []
-        self.validation_perplexities = []
+    def __init__(self, history_size: int = 128):
+        self.validation_losses = deque(maxlen=history_size)
+        self.validation_perplexities = deque(maxlen=history_size)
         
     def on_evaluate(
         self, 
@@ -155,8 +304,12 @@ class ValidationLossLoggerCallback(TrainerCallback):
         val_loss = metrics.get("eval_loss")
         val_ppl = metrics.get("eval_perplexity")
         
+        # Only derive perplexity if compute_metrics didn't already report it
         if val_ppl is None and val_loss is not None:
-            val_ppl = np.exp(val_loss)
+            try:
+                val_ppl = math.exp(val_loss)
+            except OverflowError:
+                val_ppl = float("inf")
         
         if val_loss is not None:
             self.validation_losses.append(val_loss)
@@ -165,7 +318,7 @@ class ValidationLossLoggerCallback(TrainerCallback):
             self.validation_perplexities.append(val_ppl)
             
         print(f"\n📈 Validation Metrics (Step {state.global_step}):")
-        print(f"   Loss: {val_loss:.4f}" if val_loss else "   Loss: N/A")
-        print(f"   Perplexity: {val_ppl:.4f}" if val_ppl else "   Perplexity: N/A")
+        print(f"   Loss: {val_loss:.4f}" if val_loss is not None else "   Loss: N/A")
+        print(f"   Perplexity: {val_ppl:.4f}" if val_ppl is not None else "   Perplexity: N/A")
         
         return control
@@ -8,56 +8,122 @@ Reference:
 - https://github.com/huggingface/transformers/issues/32307
 """
 
+import math
 import torch
+import torch.nn.functional as F
 import numpy as np
-from typing import Dict
+from typing import Dict, Tuple
 from transformers import EvalPrediction
 
 
+def preprocess_logits_for_metrics(logits: torch.Tensor, labels: torch.Tensor, with_accuracy: bool = True) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Reduce logits on-device, per eval batch, before the Trainer gathers them.
+    
+    Pass as `Trainer(preprocess_logits_for_metrics=...)` so the full
+    (batch, seq, vocab) logits never reach the host. Cross entropy is summed
+    (not averaged) so batches can be combined exactly: ppl = exp(Σloss / Σtokens).
+    The sum is taken in float32: an fp16 sum overflows past 65504 and a
+    bf16 one drifts by ~0.5%.
+    
+    Use `functools.partial(preprocess_logits_for_metrics, with_accuracy=False)`
+    with `compute_perplexity_only` to skip the vocab-wide argmax.
+    
+    Args:
+        logits: Model logits (batch, seq_len, vocab_size), in the model's dtype
+        labels: Labels (batch, seq_len), -100 for ignored positions
+        with_accuracy: Count correct tokens (otherwise the count is 0)
+    
+    Returns:
+        Tuple of (float32 summed CE loss, int64 valid token count,
+        int64 correct token count)
+    """
+    if isinstance(logits, tuple):
+        logits = logits[0]
+    
+    # Causal LM: logits at t predict token t+1. Shift the (small) labels
+    # instead of slicing the logits, so logits.view() needs no copy.
+    shift_labels = F.pad(labels[:, 1:], (0, 1), value=-100)
+    # Per-token CE in the logits' dtype, summed in float32
+    loss_sum = F.cross_entropy(
+        logits.view(-1, logits.size(-1)),
+        shift_labels.reshape(-1),
+        ignore_index=-100,
+        reduction="none",
+    ).float().sum()
+    # Accuracy as masked reductions over the original buffers (no gather)
+    valid = shift_labels != -100
+    token_count = valid.sum(dtype=torch.int64)
+    if with_accuracy:
+        correct_count = ((logits.argmax(dim=-1) == shift_labels) & valid).sum(dtype=torch.int64)
+    else:
+        correct_count = torch.zeros((), dtype=torch.int64, device=logits.device)
+    
+    return loss_sum.reshape(1), token_count.reshape(1), correct_count.reshape(1)
+
+
 def compute_metrics(eval_pred: EvalPrediction) -> Dict[str, float]:
     """
     Compute evaluation metrics for language model.
     
     Metrics:
     - Perplexity: exp(loss) - main metric for language models
+    - Token Loss: token-weighted mean CE that the perplexity is derived from
+      (the Trainer's own eval_loss is a mean of per-batch losses and
+      overwrites any "eval_loss" returned here)
     - Token Accuracy: Token-level accuracy (optional)
     
+    Expects predictions reduced by `preprocess_logits_for_metrics`; raw
+    logits are still accepted (slow host-side path).
+    
     Args:
         eval_pred: Evaluation predictions from trainer
     
     Returns:
-        Dictionary with perplexity, eval_loss, and token_accuracy
+        Dictionary with perplexity, token_loss, and token_accuracy
     """
     logits = eval_pred.predictions
     labels = eval_pred.label_ids
     
+    if isinstance(logits, tuple):
+        loss_sums, token_counts, correct_counts = logits
+        total_tokens = int(token_counts.sum())
+        eval_loss = float(loss_sums.sum()) / total_tokens
+        
+        return {
+            "perplexity": math.exp(eval_loss),
+            "token_loss": eval_loss,
+            "token_accuracy": int(correct_counts.sum()) / total_tokens
+        }
+    
     # Reshape for loss calculation
     # Flatten: (batch_size * seq_len, vocab_size) and (batch_size * seq_len,)
     logits_flat = logits.reshape(-1, logits.shape[-1])
     labels_flat = labels.reshape(-1)
     
-    # Filter padding tokens (usually -100)
+    # Padding tokens (usually -100) are skipped via ignore_index / the mask
+    # below instead of boolean-indexing a (n_valid, vocab_size) copy
     mask = labels_flat != -100
-    logits_flat = logits_flat[mask]
-    labels_flat = labels_flat[mask]
     
     # Calculate Cross Entropy Loss
-    loss_fct = torch.nn.CrossEntropyLoss()
-    loss = loss_fct(
+    loss = F.cross_entropy(
         torch.from_numpy(logits_flat).float(),
-        torch.from_numpy(labels_flat).long()
+        torch.from_numpy(labels_flat).long(),
+        ignore_index=-100
     )
     
     # Perplexity = exp(loss)
     perplexity = torch.exp(loss).item()
     
-    # Token-level accuracy (optional)
-    predictions = np.argmax(logits_flat, axis=-1)
-    accuracy = (predictions == labels_flat).mean()
+    # Token-level accuracy (optional); int32 indices are plenty for any
+    # vocab and halve the predictions buffer vs argmax's default int64
+    predictions = np.empty(labels_flat.shape[0], dtype=np.int32)
+    np.argmax(logits_flat, axis=-1, out=predictions)
+    accuracy = ((predictions == labels_flat) & mask).sum() / mask.sum()
     
     return {
         "perplexity": perplexity,
-        "eval_loss": loss.item(),
+        "token_loss": loss.item(),
         "token_accuracy": float(accuracy)
     }
 
@@ -71,25 +137,28 @@ def compute_perplexity_only(eval_pred: EvalPrediction) -> Dict[str, float]:
         eval_pred: Evaluation predictions from trainer
     
     Returns:
-        Dictionary with perplexity only
+        Dictionary with perplexity and the token_loss it is derived from
     """
     logits = eval_pred.predictions
     labels = eval_pred.label_ids
     
+    if isinstance(logits, tuple):
+        loss_sums, token_counts, _ = logits
+        token_loss = float(loss_sums.sum()) / int(token_counts.sum())
+        return {
+            "perplexity": math.exp(token_loss),
+            "token_loss": token_loss,
+        }
+    
     # Reshape
     logits_flat = logits.reshape(-1, logits.shape[-1])
     labels_flat = labels.reshape(-1)
     
-    # Filter padding
-    mask = labels_flat != -100
-    logits_flat = logits_flat[mask]
-    labels_flat = labels_flat[mask]
-    
-    # Loss
-    loss_fct = torch.nn.CrossEntropyLoss()
-    loss = loss_fct(
+    # Loss (padding skipped via ignore_index, no masked copy of the logits)
+    loss = F.cross_entropy(
         torch.from_numpy(logits_flat).float(),
-        torch.from_numpy(labels_flat).long()
+        torch.from_numpy(labels_flat).long(),
+        ignore_index=-100
     )
     
     # Perplexity
@@ -97,4 +166,6 @@ def compute_perplexity_only(eval_pred: EvalPrediction) -> Dict[str, float]:
     
     return {
         "perplexity": perplexity,
+        "token_loss": loss.item(),
     }
+
@@ -9,28 +9,48 @@ Reference:
 - https://www.runpod.io/articles/guides/fp16-bf16-fp8-mixed-precision-speed-up-my-model-training
 """
 
+import functools
 import torch
 from typing import Tuple
 
 
-def setup_mixed_precision() -> Tuple[bool, bool, str]:
+@functools.lru_cache(maxsize=1)
+def setup_mixed_precision() -> Tuple[bool, bool, str, bool]:
     """
     Setup mixed precision with fallback strategy.
     
+    The device probe runs once per process (cached). On multi-GPU boxes the
+    precision is chosen for the weakest GPU, so every rank agrees.
+    
+    On Ampere+ (bf16 path) TF32 tensor cores are also enabled for the FP32
+    ops that stay outside autocast (reductions, norms, optimizer math).
+    
     Returns:
-        Tuple of (bf16_support, fp16_support, precision_mode)
+        Tuple of (bf16_support, fp16_support, precision_mode, tf32_enabled)
     """
     bf16_support = False
     fp16_support = False
     precision_mode = "fp32"
+    tf32_enabled = False
     
     if torch.cuda.is_available():
+        # One properties query per device (name, capability, memory in one struct)
+        all_props = [torch.cuda.get_device_properties(i) for i in range(torch.cuda.device_count())]
+        props = min(all_props, key=lambda p: (p.major, p.minor))
+        
         # Check BF16 support (Ampere and newer: A100, RTX 3090, RTX 4090)
         # Note: T4 compute capability = 7.5, so bf16 = False
-        if torch.cuda.get_device_capability()[0] >= 8:
+        if props.major >= 8:
             bf16_support = True
             precision_mode = "bf16"
             print("✅ BF16 mixed precision ENABLED (best option)")
+            
+            # TF32 for the remaining FP32 matmuls/convs (no-op on older GPUs)
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
+            torch.set_float32_matmul_precision("high")
+            tf32_enabled = True
+            print("✅ TF32 matmul ENABLED")
         else:
             # Fallback to FP16 for older GPUs (T4, V100, etc.)
             fp16_support = True
@@ -39,11 +59,11 @@ def setup_mixed_precision() -> Tuple[bool, bool, str]:
             print("⚠️  Note: FP16 requires gradient scaling for stability")
             
         # Print GPU info
-        gpu_name = torch.cuda.get_device_name(0)
-        compute_cap = torch.cuda.get_device_capability(0)
-        total_mem = torch.cuda.get_device_properties(0).total_memory / 1e9
-        print(f"🖥️  GPU: {gpu_name} (Compute {compute_cap[0]}.{compute_cap[1]}, {total_mem:.1f}GB)")
+        total_mem = props.total_memory / 1e9
+        print(f"🖥️  GPU: {props.name} (Compute {props.major}.{props.minor}, {total_mem:.1f}GB)")
+        if len(all_props) > 1:
+            print(f"   ({len(all_props)} GPUs, precision chosen for the weakest)")
     else:
         print("⚠️  No CUDA detected, using FP32 (slow)")
     
-    return bf16_support, fp16_support, precision_mode
+    return bf16_support, fp16_support, precision_mode, tf32_enabled
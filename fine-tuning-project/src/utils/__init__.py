@@ -1,4 +1,8 @@
 # src/utils/__init__.py
 """Utility modules"""
 
-__all__ = []
+from .cuda_alloc import CUDA_ALLOC_CONF
+
+__all__ = [
+    "CUDA_ALLOC_CONF",
+]
@@ -0,0 +1,13 @@
+"""
+PyTorch CUDA caching-allocator config shared by colab_setup.py and the
+training callbacks.
+
+Kept free of torch/transformers imports so colab_setup.py can read it
+before dependencies are installed.
+"""
+
+# Expandable segments (CUDA VMM) let the caching allocator grow contiguous
+# regions instead of fragmenting; large blocks are not split below 256 MB and
+# cached blocks are reclaimed once usage passes 80% of the limit. Must be in
+# the environment before the first CUDA allocation.
+CUDA_ALLOC_CONF = "expandable_segments:True,max_split_size_mb:256,garbage_collection_threshold:0.8"
@@ -5,18 +5,25 @@ Test Model Script
 Evaluate trained model on test set (ONLY after training is complete!).
 
 Usage:
-    python scripts/test_model.py --model ./outputs/final_model --dataset ./outputs/test_dataset.json
+    python scripts/test_model.py --model ./outputs/final_model --dataset ./outputs/test_dataset
+    
+    # Hand-crafted JSON/JSONL test file:
+    python scripts/test_model.py --model ./outputs/final_model --dataset my_test.jsonl --json
 
 Reference:
 - https://huggingface.co/docs/transformers/perplexity
 """
 
+import os
+import math
 import torch
+import torch.nn.functional as F
 import argparse
 import numpy as np
 from pathlib import Path
-from datasets import load_dataset
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from datasets import load_dataset, load_from_disk
+from torch.utils.data import DataLoader
+from transformers import AutoTokenizer, AutoModelForCausalLM, DataCollatorWithPadding
 from tqdm import tqdm
 
 
@@ -25,15 +32,20 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Evaluate fine-tuned model on test set")
     parser.add_argument(
         "--model", 
-        type=str, 
+        type=Path, 
         required=True,
         help="Path to trained model"
     )
     parser.add_argument(
         "--dataset", 
-        type=str, 
+        type=Path, 
         required=True,
-        help="Path to test dataset (JSON/JSONL)"
+        help="Path to test dataset (Arrow directory from train.py, or JSON/JSONL with --json)"
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Load --dataset as a JSON/JSONL file instead of an Arrow directory"
     )
     parser.add_argument(
         "--max_samples", 
@@ -47,10 +59,49 @@ def parse_args():
         default=2048,
         help="Maximum sequence length for evaluation"
     )
+    parser.add_argument(
+        "--batch_size", 
+        type=int, 
+        default=2,
+        help="Evaluation batch size (logits memory scales with batch x length x vocab; Gemma 3 has a 262k vocab)"
+    )
+    parser.add_argument(
+        "--skip_accuracy",
+        action="store_true",
+        help="Only compute loss/perplexity (skips the vocab-wide argmax, cheaper on TPU)"
+    )
     return parser.parse_args()
 
 
-def evaluate_on_test_set(model_path: str, test_dataset_path: str, max_samples: int = None, max_length: int = 2048):
+def get_eval_dtype() -> torch.dtype:
+    """
+    Pick the evaluation dtype without assuming CUDA.
+    
+    bfloat16 on TPU (torch_xla present) and Ampere+ GPUs; float16 only on
+    pre-Ampere CUDA. Gemma 3 is trained in bf16, and fp16 inflates its
+    perplexity, so bf16 is the default everywhere else too.
+    """
+    try:
+        import torch_xla  # noqa: F401
+        return torch.bfloat16
+    except ImportError:
+        pass
+    
+    if torch.cuda.is_available() and torch.cuda.get_device_capability()[0] < 8:
+        return torch.float16
+    return torch.bfloat16
+
+
+def get_eval_device() -> torch.device:
+    """XLA device if torch_xla is installed, else CUDA, else CPU."""
+    try:
+        import torch_xla.core.xla_model as xm
+        return xm.xla_device()
+    except ImportError:
+        return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def evaluate_on_test_set(model_path: Path, test_dataset_path: Path, max_samples: int = None, max_length: int = 2048, batch_size: int = 2, json_format: bool = False, compute_accuracy: bool = True):
     """
     Evaluate trained model on test set.
     
@@ -64,6 +115,9 @@ def evaluate_on_test_set(model_path: str, test_dataset_path: str, max_samples: i
         test_dataset_path: Path to test dataset
         max_samples: Maximum samples to evaluate (None = all)
         max_length: Maximum sequence length
+        batch_size: Number of examples per forward pass
+        json_format: Load test_dataset_path as JSON/JSONL instead of Arrow
+        compute_accuracy: Also compute token accuracy (argmax over the vocab)
     
     Returns:
         Dictionary with test metrics
@@ -74,63 +128,124 @@ def evaluate_on_test_set(model_path: str, test_dataset_path: str, max_samples: i
     # Load model and tokenizer
     print("\n📥 Loading model...")
     tokenizer = AutoTokenizer.from_pretrained(model_path)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # Eval never generates: pad on the right so real tokens keep the same
+    # positions whatever the batch (Gemma's tokenizer defaults to left)
+    tokenizer.padding_side = "right"
+    # Single-device eval: move the model once instead of device_map="auto",
+    # whose accelerate hooks add dispatch overhead to every forward
+    device = get_eval_device()
     model = AutoModelForCausalLM.from_pretrained(
         model_path,
-        torch_dtype=torch.bfloat16 if torch.cuda.get_device_capability()[0] >= 8 else torch.float16,
-        device_map="auto"
-    )
+        torch_dtype=get_eval_dtype(),
+        low_cpu_mem_usage=True
+    ).to(device)
     model.eval()
     
     # Load test dataset
     print("📥 Loading test dataset...")
-    test_dataset = load_dataset("json", data_files=test_dataset_path, split="train")
+    if json_format:
+        test_dataset = load_dataset("json", data_files=str(test_dataset_path), split="train")
+    else:
+        test_dataset = load_from_disk(test_dataset_path)
     if max_samples:
         test_dataset = test_dataset.select(range(min(max_samples, len(test_dataset))))
     
     print(f"   Test samples: {len(test_dataset)}")
     
-    # Evaluate
-    total_loss = 0.0
-    total_tokens = 0
-    total_correct = 0
+    # Evaluate (accumulators stay on device; single host sync after the loop)
+    total_loss = torch.zeros((), dtype=torch.float32, device=device)
+    total_tokens = torch.zeros((), dtype=torch.long, device=device)
+    total_correct = torch.zeros((), dtype=torch.long, device=device)
     
     print("\n📊 Evaluating...")
-    with torch.no_grad():
-        for example in tqdm(test_dataset, desc="Evaluating"):
-            # Tokenize
-            inputs = tokenizer(
-                example["text"],
-                return_tensors="pt",
-                truncation=True,
-                max_length=max_length
-            ).to(model.device)
-            
-            # Forward pass
-            outputs = model(**inputs, labels=inputs["input_ids"])
+    # Tokenize once up front (parallel, Arrow-cached across runs), unpadded
+    def tokenize(batch):
+        return tokenizer(batch["text"], truncation=True, max_length=max_length, return_length=True)
+    
+    num_proc = min(os.cpu_count() or 1, len(test_dataset) // 1000)
+    test_dataset = test_dataset.map(
+        tokenize,
+        batched=True,
+        batch_size=1000,
+        num_proc=num_proc if num_proc > 1 else None,
+        remove_columns=test_dataset.column_names,
+        desc="Tokenizing"
+    )
+    
+    # Batch by length (longest first) so each batch is only padded to its
+    # own max; metrics are order-invariant
+    lengths = np.asarray(test_dataset.with_format("numpy", columns=["length"])[:]["length"])
+    order = np.argsort(lengths, kind="stable")[::-1]
+    batches = [order[i:i + batch_size].tolist() for i in range(0, len(order), batch_size)]
+    
+    # Workers pad the next batches while the device runs the current one.
+    # On XLA, pad to MXU-sized multiples so few distinct shapes get compiled.
+    loader = DataLoader(
+        test_dataset.remove_columns("length"),
+        batch_sampler=batches,
+        collate_fn=DataCollatorWithPadding(
+            tokenizer,
+            pad_to_multiple_of=128 if device.type == "xla" else 8
+        ),
+        num_workers=min(4, os.cpu_count() or 1),
+        pin_memory=device.type == "cuda"
+    )
+    if device.type == "xla":
+        # MpDeviceLoader preloads batches onto the TPU and marks a step after
+        # each one, so every forward pass is its own small graph instead of
+        # chaining the whole loop into one graph that only runs at .item()
+        import torch_xla.distributed.parallel_loader as pl
+        loader = pl.MpDeviceLoader(loader, device)
+    
+    with torch.inference_mode():
+        for batch in tqdm(loader, desc="Evaluating"):
+            inputs = {k: v.to(device, non_blocking=True) for k, v in batch.items()}
             
-            # Accumulate metrics
-            seq_len = inputs["input_ids"].size(1)
-            loss = outputs.loss.item()
-            total_loss += loss * seq_len
-            total_tokens += seq_len
+            # Forward pass (loss computed below, per real token)
+            outputs = model(**inputs)
             
-            # Accuracy (optional)
+            # Causal LM: logits at t predict token t+1. Shift the (small)
+            # labels instead of slicing the logits, so the (batch, seq, vocab)
+            # logits are never sliced into a copy. Padding is masked via the attention
+            # mask (not pad_token_id, which may equal eos); both the input and
+            # the target position must be real, so the last pad before the
+            # first token doesn't count as a prediction under left padding
+            # (Gemma's tokenizer pads on the left).
             logits = outputs.logits
-            predictions = torch.argmax(logits[:, :-1, :], dim=-1)
-            targets = inputs["input_ids"][:, 1:]
-            total_correct += (predictions == targets).sum().item()
+            attention_mask = inputs["attention_mask"].bool()
+            mask = F.pad(attention_mask[:, :-1] & attention_mask[:, 1:], (0, 1), value=False)
+            labels = F.pad(inputs["input_ids"][:, 1:], (0, 1), value=-100).masked_fill(~mask, -100)
+            
+            # Accumulate metrics: per-token CE in the logits' own dtype (no
+            # fp32 copy of the vocab-wide logits), summed in fp32 so the
+            # running total neither overflows nor loses precision
+            total_loss += F.cross_entropy(
+                logits.view(-1, logits.size(-1)),
+                labels.view(-1),
+                ignore_index=-100,
+                reduction="none"
+            ).float().sum()
+            total_tokens += mask.sum()
+            
+            # Accuracy (optional); masked labels are -100 and never match
+            if compute_accuracy:
+                total_correct += (logits.argmax(dim=-1) == labels).sum()
     
     # Calculate final metrics
+    total_loss = total_loss.item()
+    total_tokens = total_tokens.item()
     avg_loss = total_loss / total_tokens
-    perplexity = np.exp(avg_loss)
-    accuracy = total_correct / total_tokens
+    perplexity = math.exp(avg_loss)
+    accuracy = total_correct.item() / total_tokens if compute_accuracy else None
     
     print(f"\n" + "=" * 60)
     print(f"📊 TEST SET RESULTS")
     print(f"=" * 60)
     print(f"   Test Loss: {avg_loss:.4f}")
     print(f"   Test Perplexity: {perplexity:.4f}")
-    print(f"   Token Accuracy: {accuracy*100:.2f}%")
+    print(f"   Token Accuracy: {accuracy*100:.2f}%" if accuracy is not None else "   Token Accuracy: N/A")
     print(f"   Total Tokens: {total_tokens:,}")
     print(f"=" * 60)
     
@@ -152,14 +267,16 @@ def main():
         model_path=args.model,
         test_dataset_path=args.dataset,
         max_samples=args.max_samples,
-        max_length=args.max_length
+        max_length=args.max_length,
+        batch_size=args.batch_size,
+        json_format=args.json,
+        compute_accuracy=not args.skip_accuracy
     )
     
     # Save results
     import json
-    results_path = Path(args.model).parent / "test_results.json"
-    with open(results_path, "w") as f:
-        json.dump(results, f, indent=2)
+    results_path = args.model.parent / "test_results.json"
+    results_path.write_text(json.dumps(results, indent=2))
     print(f"\n✅ Results saved to: {results_path}")
 
 
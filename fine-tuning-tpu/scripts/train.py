@@ -33,7 +33,7 @@ from transformers import AutoTokenizer, TrainingArguments, DataCollatorForLangua
 
 # Import our modules
 from src.data.dataset_analyzer import analyze_dataset_and_configure
-from src.data.dataset_splitter import split_dataset, analyze_split_distribution
+from src.data.dataset_splitter import split_dataset, tokenize_splits, truncate_splits, analyze_split_distribution
 from src.training.mixed_precision import setup_mixed_precision_tpu, get_tpu_world_size
 from src.training.callbacks import (
     TPULoggingCallback,
@@ -41,7 +41,7 @@ from src.training.callbacks import (
     EarlyStoppingCallback,
     ValidationLossLoggerCallback,
 )
-from src.training.metrics import compute_perplexity_only
+from src.training.metrics import PerplexityFromLossMixin
 from src.models.lora_config import get_dynamic_lora_config
 
 
@@ -49,14 +49,6 @@ from src.models.lora_config import get_dynamic_lora_config
 MODEL_NAME = "google/gemma-3-270m-it"  # Gemma 3 270M Instruct
 TPU_CORES = 8  # TPU v2/v3 has 8 cores
 
-# W&B Setup (optional)
-USE_WANDB = False
-try:
-    import wandb
-    USE_WANDB = True
-except ImportError:
-    print("⚠️  wandb not installed, using TensorBoard only")
-
 
 def parse_args():
     """Parse command line arguments."""
@@ -85,12 +77,23 @@ def parse_args():
         default="gemma3-finetuning-tpu",
         help="Weights & Biases project name"
     )
+    parser.add_argument(
+        "--use_wandb",
+        action="store_true",
+        help="Log to Weights & Biases (wandb is only imported when set)"
+    )
     parser.add_argument(
         "--batch_size_per_replica",
         type=int,
         default=128,
         help="Batch size per TPU replica (should be multiple of 128)"
     )
+    parser.add_argument(
+        "--target_global_batch_size",
+        type=int,
+        default=1024,
+        help="Desired global batch size; gradient accumulation only fills the gap left by replicas"
+    )
     return parser.parse_args()
 
 
@@ -101,6 +104,9 @@ def main():
     print("🚀 Gemma 3 270M Fine-Tuning Script (TPU Edition)")
     print("=" * 80)
     
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    
     # ===== 1. TPU SETUP =====
     print("\n🔧 Setting up TPU...")
     try:
@@ -139,9 +145,8 @@ def main():
     )
     
     # Save test set for final evaluation
-    os.makedirs(args.output_dir, exist_ok=True)
-    test_dataset_path = f"{args.output_dir}/test_dataset.json"
-    dataset_dict["test"].to_json(test_dataset_path)
+    test_dataset_path = output_dir / "test_dataset"
+    dataset_dict["test"].save_to_disk(test_dataset_path)  # Arrow, memory-mapped on load
     print(f"✅ Test dataset saved to: {test_dataset_path}")
     print("⚠️  DO NOT use test set until training is fully complete!")
     
@@ -151,10 +156,14 @@ def main():
     if tokenizer.pad_token is None:
         tokenizer.add_special_tokens({'pad_token': '[PAD]'})
     
+    # Tokenize every split exactly once; the length analysis below and the
+    # trainer both reuse these input_ids instead of re-tokenizing the corpus
+    tokenized_splits = tokenize_splits(dataset_dict, tokenizer)
+    
     # ===== 6. ANALYZE DATASET (TRAIN SET ONLY!) =====
     # Gemma 3 270M has 32K context window (not 128K like larger variants)
-    train_dataset, dynamic_config = analyze_dataset_and_configure(
-        dataset_dict["train"], 
+    _, dynamic_config = analyze_dataset_and_configure(
+        tokenized_splits["train"], 
         tokenizer, 
         max_length=32768,  # Gemma 3 270M max context
         vram_gb=16.0  # Not relevant for TPU but kept for compatibility
@@ -163,7 +172,11 @@ def main():
     # Override batch size for TPU optimization
     # TPU works best with batch sizes that are multiples of 128
     dynamic_config["per_device_train_batch_size"] = args.batch_size_per_replica
-    dynamic_config["gradient_accumulation_steps"] = max(1, 256 // args.batch_size_per_replica)
+    # Replicas already multiply the batch; accumulate only what's still missing
+    # (every extra GA step is another XLA graph execution per optimizer step)
+    dynamic_config["gradient_accumulation_steps"] = max(
+        1, args.target_global_batch_size // (args.batch_size_per_replica * world_size)
+    )
     dynamic_config["global_batch_size"] = (
         dynamic_config["per_device_train_batch_size"] * 
         world_size * 
@@ -174,10 +187,16 @@ def main():
     print(f"   Batch size per replica: {dynamic_config['per_device_train_batch_size']}")
     print(f"   TPU cores: {world_size}")
     print(f"   Gradient accumulation: {dynamic_config['gradient_accumulation_steps']}")
-    print(f"   Global batch size: {dynamic_config['global_batch_size']}")
+    print(f"   Global batch size: {dynamic_config['global_batch_size']} (target: {args.target_global_batch_size})")
     
     # Analyze distribution for each split
-    analyze_split_distribution(dataset_dict, tokenizer)
+    analyze_split_distribution(tokenized_splits, tokenizer)
+    
+    # TRL's own preparation is skipped below, so truncate here (slicing only)
+    tokenized_splits = truncate_splits(
+        {split: tokenized_splits[split] for split in ("train", "validation")},
+        dynamic_config["max_seq_length"],
+    )
     
     # ===== 7. LOAD MODEL =====
     print(f"\n🔥 Loading model: {MODEL_NAME}")
@@ -185,15 +204,19 @@ def main():
     from transformers import AutoModelForCausalLM
     from peft import get_peft_model, LoraConfig
     
-    # Load model with official Google recommended settings
+    # Load model with official Google recommended settings.
+    # dtype is explicit: "auto" can resolve to fp32 on XLA and silently
+    # train without bf16 MXU ops.
+    model_dtype = torch.bfloat16 if precision_mode == "bf16" else torch.float32
     model = AutoModelForCausalLM.from_pretrained(
         MODEL_NAME,
-        torch_dtype="auto",  # Auto-detect best dtype
+        torch_dtype=model_dtype,
         device_map="auto",
         attn_implementation="eager",  # Official Google recommendation
         trust_remote_code=True,
     )
     
+    assert next(model.parameters()).dtype == model_dtype, "Model weights not loaded in the selected precision"
     print(f"✅ Model loaded with dtype: {model.dtype}")
     print(f"   Device: {model.device}")
     print(f"   Attention: eager (Google recommended)")
@@ -222,23 +245,25 @@ def main():
         pad_to_multiple_of=128  # TPU optimization: pad to multiples of 128
     )
     
-    # ===== 10. W&B SETUP =====
-    if USE_WANDB:
+    # ===== 10. W&B SETUP (opt-in) =====
+    # wandb is only imported on request: its import is slow and starts
+    # background threads that don't mix well with XLA's process model
+    use_wandb = False
+    if args.use_wandb:
         try:
+            import wandb
             wandb.login()
             os.environ["WANDB_PROJECT"] = args.wandb_project
+            use_wandb = True
             print(f"✅ Weights & Biases enabled: {args.wandb_project}")
-        except:
-            global USE_WANDB
-            USE_WANDB = False
+        except ImportError:
+            print("⚠️  wandb not installed, using TensorBoard only")
+        except Exception:
             print("⚠️  W&B login failed, using TensorBoard only")
     
     # ===== 11. TRAINING ARGUMENTS (Official Google Pattern) =====
-    # Detect model dtype for precision settings
-    torch_dtype = model.dtype
-    
     training_args = TrainingArguments(
-        output_dir=args.output_dir,
+        output_dir=str(output_dir),
         per_device_train_batch_size=dynamic_config["per_device_train_batch_size"],
         gradient_accumulation_steps=dynamic_config["gradient_accumulation_steps"],
         
@@ -248,9 +273,9 @@ def main():
         lr_scheduler_type="constant",  # Official Google recommendation
         warmup_ratio=0.1,
         
-        # Precision - auto-detect from model
-        bf16=True if torch_dtype == torch.bfloat16 else False,
-        fp16=True if torch_dtype == torch.float16 else False,
+        # Precision - from TPU setup (bf16 only, TPU has no fp16)
+        bf16=bf16_support,
+        fp16=fp16_support,
         
         # Optimizer - Official Google recommendation
         optim="adamw_torch_fused",  # Fused optimizer for better performance
@@ -263,6 +288,8 @@ def main():
         # Evaluation
         eval_strategy="epoch",  # Official Google: per epoch
         per_device_eval_batch_size=dynamic_config["per_device_train_batch_size"],
+        prediction_loss_only=True,  # Only the loss leaves the device during eval
+        eval_accumulation_steps=None,  # Reduce on device, no per-N-steps host offload
         load_best_model_at_end=True,
         metric_for_best_model="eval_loss",
         greater_is_better=False,
@@ -273,11 +300,14 @@ def main():
         save_total_limit=3,
         
         # Reporting
-        report_to=["wandb", "tensorboard"] if USE_WANDB else ["tensorboard"],
+        report_to=["wandb", "tensorboard"] if use_wandb else ["tensorboard"],
         
         # Performance
-        dataloader_num_workers=4,
-        dataloader_pin_memory=True,
+        # Workers live across epochs (no re-fork per epoch) and prefetch ahead
+        dataloader_num_workers=min(8, os.cpu_count() or 1),
+        dataloader_persistent_workers=True,
+        dataloader_prefetch_factor=4,
+        dataloader_pin_memory=True,  # Harmless on TPU (XLA has its own prefetch path)
         torch_compile=False,
         
         # Push to Hub (optional)
@@ -298,31 +328,39 @@ def main():
     # ===== 13. TRAINER (Official Google Pattern) =====
     try:
         from trl import SFTTrainer
-        trainer = SFTTrainer(
+        
+        # eval_perplexity from eval_loss (no logits needed), added before logging
+        class TPUSFTTrainer(PerplexityFromLossMixin, SFTTrainer):
+            pass
+        
+        trainer = TPUSFTTrainer(
             model=model,
             args=training_args,
-            train_dataset=dataset_dict["train"],
-            eval_dataset=dataset_dict["validation"],
+            train_dataset=tokenized_splits["train"],
+            eval_dataset=tokenized_splits["validation"],
+            data_collator=data_collator,
             callbacks=callbacks,
             processing_class=tokenizer,  # Official Google pattern
             max_seq_length=dynamic_config["max_seq_length"],
             packing=False,  # Official Google: packing=False
             dataset_kwargs={
-                "add_special_tokens": False,  # Template with special tokens
-                "append_concat_token": True,  # Add EOS token as separator
+                "skip_prepare_dataset": True,  # Already tokenized (chat template) above
             },
         )
         print("✅ Using SFTTrainer from TRL (Official Google pattern)")
     except ImportError:
         from transformers import Trainer
-        trainer = Trainer(
+        
+        class TPUTrainer(PerplexityFromLossMixin, Trainer):
+            pass
+        
+        trainer = TPUTrainer(
             model=model,
             args=training_args,
-            train_dataset=dataset_dict["train"],
-            eval_dataset=dataset_dict["validation"],
+            train_dataset=tokenized_splits["train"],
+            eval_dataset=tokenized_splits["validation"],
             data_collator=data_collator,
             callbacks=callbacks,
-            compute_metrics=compute_perplexity_only,
         )
         print("✅ Using Trainer from transformers")
     
@@ -335,7 +373,7 @@ def main():
     
     # ===== 15. SAVE MODEL =====
     print("\n💾 Saving final model...")
-    final_model_path = f"{args.output_dir}/final_model"
+    final_model_path = output_dir / "final_model"
     
     # For TPU, use xm.save for proper saving
     try:
@@ -364,7 +402,7 @@ def main():
     print(f"   Run: python scripts/test_model.py --model {final_model_path} --dataset {test_dataset_path}")
     
     # ===== 17. CLEANUP =====
-    if USE_WANDB:
+    if use_wandb:
         wandb.finish()
 
 
@@ -1,12 +1,13 @@
 # src/data/__init__.py
 """Data processing modules"""
 
-from .dataset_analyzer import analyze_dataset_and_configure, estimate_vram_usage
-from .dataset_splitter import split_dataset, analyze_split_distribution
+from .dataset_analyzer import analyze_dataset_and_configure
+from .dataset_splitter import split_dataset, tokenize_splits, truncate_splits, analyze_split_distribution
 
 __all__ = [
     "analyze_dataset_and_configure",
-    "estimate_vram_usage",
     "split_dataset",
+    "tokenize_splits",
+    "truncate_splits",
     "analyze_split_distribution",
 ]
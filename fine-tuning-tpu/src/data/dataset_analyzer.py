@@ -1,3 +1,4 @@
+import os
 
 def _format_messages_to_text(messages):
     """
@@ -19,35 +20,39 @@ def analyze_dataset_and_configure(dataset, tokenizer, max_length=1024, vram_gb=1
     print("🔍 Analyzing dataset...")
     print(f"   Initial dataset columns: {dataset.column_names}")
 
+    if 'length' in dataset.column_names:
+        # Pre-tokenized (see tokenize_splits): reuse the cached lengths
+        print("   Using precomputed token lengths.")
     # Ensure 'messages' column exists. If not, can't proceed with this strategy.
-    if 'messages' not in dataset.column_names:
+    elif 'messages' not in dataset.column_names:
         raise ValueError("Dataset does not contain a 'messages' column. This script expects conversational data.")
 
-    # Always ensure 'text' is generated from 'messages' for consistency
-    # This proactively creates/overwrites 'text' if 'messages' exists
-    print("   Proactively converting 'messages' to 'text' for length analysis...")
-    dataset = dataset.map(
-        lambda x: {"text": _format_messages_to_text(x.get("messages", []))},
-        num_proc=os.cpu_count() // 2 or 1,
-        desc="Formatting messages to text",
-        load_from_cache_file=False # Force recomputation
-    )
-    print("   Conversion complete.")
-    print(f"   Dataset columns after 'messages' to 'text' conversion: {dataset.column_names}")
-
-    # Final check: 'text' column MUST exist at this point.
-    if 'text' not in dataset.column_names:
-        raise ValueError("FATAL: 'text' column was not created by the 'messages' conversion. Please check your dataset structure.")
-
-    # Tokenize and calculate lengths
-    print(f"   Columns before token length calculation: {dataset.column_names}")
-    dataset = dataset.map(
-        lambda x: {"length": len(tokenizer.encode(x["text"], add_special_tokens=False))},
-        num_proc=os.cpu_count() // 2 or 1,
-        desc="Calculating token lengths",
-        load_from_cache_file=False # Force recomputation
-    )
-    print(f"   Columns after token length calculation: {dataset.column_names}")
+    else:
+        # Always ensure 'text' is generated from 'messages' for consistency
+        # This proactively creates/overwrites 'text' if 'messages' exists
+        print("   Proactively converting 'messages' to 'text' for length analysis...")
+        dataset = dataset.map(
+            lambda x: {"text": _format_messages_to_text(x.get("messages", []))},
+            num_proc=os.cpu_count() // 2 or 1,
+            desc="Formatting messages to text",
+            load_from_cache_file=False # Force recomputation
+        )
+        print("   Conversion complete.")
+        print(f"   Dataset columns after 'messages' to 'text' conversion: {dataset.column_names}")
+
+        # Final check: 'text' column MUST exist at this point.
+        if 'text' not in dataset.column_names:
+            raise ValueError("FATAL: 'text' column was not created by the 'messages' conversion. Please check your dataset structure.")
+
+        # Tokenize and calculate lengths
+        print(f"   Columns before token length calculation: {dataset.column_names}")
+        dataset = dataset.map(
+            lambda x: {"length": len(tokenizer.encode(x["text"], add_special_tokens=False))},
+            num_proc=os.cpu_count() // 2 or 1,
+            desc="Calculating token lengths",
+            load_from_cache_file=False # Force recomputation
+        )
+        print(f"   Columns after token length calculation: {dataset.column_names}")
 
 
     # Find the 95th percentile length
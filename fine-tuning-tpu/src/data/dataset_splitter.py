@@ -52,12 +52,65 @@ def _format_messages_to_text(messages):
     return "\n".join(formatted_text)
 
 
+def tokenize_splits(dataset_dict, tokenizer):
+    """
+    Tokenizes every split once with the tokenizer's chat template.
+    Each split keeps only 'input_ids', 'attention_mask' and 'length', so the
+    length analysis and the trainer reuse the same (cached) tokenization.
+    """
+    def tokenize(batch):
+        encoded = tokenizer.apply_chat_template(batch["messages"], tokenize=True, return_dict=True)
+        return {
+            "input_ids": encoded["input_ids"],
+            "attention_mask": encoded["attention_mask"],
+            "length": [len(ids) for ids in encoded["input_ids"]],
+        }
+
+    tokenized_splits = {}
+    for split_name, dataset in dataset_dict.items():
+        if 'messages' not in dataset.column_names:
+            raise ValueError("Split '{}' does not contain a 'messages' column.".format(split_name))
+        # No load_from_cache_file=False here: the arrow cache is what makes
+        # re-running on the same dataset/tokenizer skip this pass entirely
+        tokenized_splits[split_name] = dataset.map(
+            tokenize,
+            batched=True,
+            num_proc=os.cpu_count() // 2 or 1,
+            remove_columns=dataset.column_names,
+            desc="Tokenizing {}".format(split_name),
+        )
+    return tokenized_splits
+
+
+def truncate_splits(tokenized_splits, max_length):
+    """Truncates pre-tokenized splits to max_length without re-tokenizing."""
+    def truncate(batch):
+        return {
+            "input_ids": [ids[:max_length] for ids in batch["input_ids"]],
+            "attention_mask": [mask[:max_length] for mask in batch["attention_mask"]],
+            "length": [min(length, max_length) for length in batch["length"]],
+        }
+
+    return {
+        split_name: dataset.map(
+            truncate,
+            batched=True,
+            num_proc=os.cpu_count() // 2 or 1,
+            desc="Truncating {} to {} tokens".format(split_name, max_length),
+        )
+        for split_name, dataset in tokenized_splits.items()
+    }
+
+
 def analyze_split_distribution(dataset_dict, tokenizer):
     print("\n📊 Analyzing token length distribution across splits:")
     for split_name, dataset in dataset_dict.items():
         print("   Initial columns for {}: {}".format(split_name, dataset.column_names))
+        if 'length' in dataset.column_names:
+            # Already tokenized (see tokenize_splits): no tokenizer call needed
+            lengths = list(dataset["length"])
         # Always ensure 'text' is generated from 'messages' for consistency
-        if 'messages' in dataset.column_names:
+        elif 'messages' in dataset.column_names:
             temp_dataset = dataset.map(
                 lambda x: {"text": _format_messages_to_text(x.get("messages", []))},
                 num_proc=os.cpu_count() // 2 or 1,
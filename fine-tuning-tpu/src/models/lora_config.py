@@ -8,9 +8,30 @@ Reference:
 - https://devtechtools.org/en/blog/lora-vs-qlora-production-fine-tuning-commodity-gpus
 """
 
+import re
 from typing import Dict
 
 
+def _size_pattern(*sizes: str) -> re.Pattern:
+    """Match a size token as a whole number ("1b" must not match "11b" or "2.1b")."""
+    return re.compile(r"(?<![\d.])(?:%s)(?!\d)" % "|".join(re.escape(size) for size in sizes))
+
+
+# (pattern, (r, alpha, use_rslora)); first match wins
+_SIZE_TABLE = (
+    (_size_pattern("270m", "0.5b", "0.6b"), (8, 16, False)),
+    (_size_pattern("1b", "1.5b", "1.7b"), (16, 32, False)),
+    (_size_pattern("6b", "7b"), (32, 64, True)),  # RSLoRA for larger models (>3B)
+)
+_DEFAULT_SIZE_CONFIG = (16, 32, False)
+
+# Target modules: QLoRA-All performs best
+_TARGET_MODULES = (
+    "q_proj", "k_proj", "v_proj", "o_proj",  # Attention
+    "gate_proj", "up_proj", "down_proj"       # FFN/MLP
+)
+
+
 def get_dynamic_lora_config(model_name: str, max_seq_length: int) -> Dict:
     """
     Generate dynamic LoRA configuration based on model size.
@@ -24,29 +45,16 @@ def get_dynamic_lora_config(model_name: str, max_seq_length: int) -> Dict:
     """
     model_lower = model_name.lower()
     
-    # Target modules: QLoRA-All performs best
-    target_modules = [
-        "q_proj", "k_proj", "v_proj", "o_proj",  # Attention
-        "gate_proj", "up_proj", "down_proj"       # FFN/MLP
-    ]
-    
-    # Dynamic rank (r) based on model size
-    if "0.5b" in model_lower or "0.6b" in model_lower or "270m" in model_lower:
-        r, alpha = 8, 16
-    elif "1.5b" in model_lower or "1b" in model_lower or "1.7b" in model_lower:
-        r, alpha = 16, 32
-    elif "6b" in model_lower or "7b" in model_lower:
-        r, alpha = 32, 64
-    else:
-        r, alpha = 16, 32  # Default
-    
-    # Use RSLoRA for larger models (>3B)
-    use_rslora = "6b" in model_lower or "7b" in model_lower
+    # Dynamic rank (r) and RSLoRA based on model size
+    r, alpha, use_rslora = next(
+        (size_config for pattern, size_config in _SIZE_TABLE if pattern.search(model_lower)),
+        _DEFAULT_SIZE_CONFIG
+    )
     
     config = {
         "r": r,
         "lora_alpha": alpha,
-        "target_modules": target_modules,
+        "target_modules": list(_TARGET_MODULES),  # PEFT expects a list
         "lora_dropout": 0,  # Disabled for faster training
         "bias": "none",
         "task_type": "CAUSAL_LM",
@@ -55,12 +63,12 @@ def get_dynamic_lora_config(model_name: str, max_seq_length: int) -> Dict:
     }
     
     # Estimate trainable parameters
-    estimated_params = r * 2 * len(target_modules) * 2048  # Rough estimate for small models
+    estimated_params = r * 2 * len(_TARGET_MODULES) * 2048  # Rough estimate for small models
     
     print(f"\n🔧 Dynamic LoRA Config for {model_name}:")
     print(f"   Rank (r): {r}")
     print(f"   Alpha: {alpha}")
-    print(f"   Target Modules: {len(target_modules)} layers")
+    print(f"   Target Modules: {len(_TARGET_MODULES)} layers")
     print(f"   RSLoRA: {use_rslora}")
     print(f"   Trainable Params: ~{estimated_params / 1e6:.2f}M\n")
     
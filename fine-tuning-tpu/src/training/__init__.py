@@ -14,7 +14,7 @@ from .mixed_precision import (
     get_tpu_device,
     get_tpu_world_size,
 )
-from .metrics import compute_metrics, compute_perplexity_only
+from .metrics import compute_metrics, compute_perplexity_only, PerplexityFromLossMixin
 
 __all__ = [
     "TPULoggingCallback",
@@ -28,4 +28,5 @@ __all__ = [
     "get_tpu_world_size",
     "compute_metrics",
     "compute_perplexity_only",
+    "PerplexityFromLossMixin",
 ]
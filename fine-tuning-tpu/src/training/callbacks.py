@@ -11,9 +11,9 @@ Reference:
 - https://docs.pytorch.org/xla/master/learn/migration-to-xla-on-tpus.html
 """
 
+import math
 from typing import Dict
 from transformers import TrainerCallback, TrainingArguments, TrainerState, TrainerControl
-import numpy as np
 
 
 class TPULoggingCallback(TrainerCallback):
@@ -27,6 +27,12 @@ class TPULoggingCallback(TrainerCallback):
     def __init__(self, log_every_n_steps: int = 50):
         self.log_every_n_steps = log_every_n_steps
         
+        try:
+            import torch_xla.core.xla_model as xm
+            self._xm = xm
+        except ImportError:
+            self._xm = None
+        
     def on_step_end(
         self, 
         args: TrainingArguments, 
@@ -35,15 +41,15 @@ class TPULoggingCallback(TrainerCallback):
         **kwargs
     ):
         # Only log at intervals to avoid TPU sync overhead
-        if state.global_step % self.log_every_n_steps == 0:
-            try:
-                import torch_xla.core.xla_model as xm
-                # Use async logging to avoid blocking
-                xm.add_step_closure(
-                    lambda: print(f"📊 Step {state.global_step}: loss={state.log_history[-1].get('loss', 'N/A'):.4f}" if state.log_history else f"📊 Step {state.global_step}")
-                )
-            except ImportError:
-                pass
+        if self._xm is not None and state.global_step % self.log_every_n_steps == 0:
+            # Build the message on host from already-materialized Python values;
+            # the step closure only prints a plain string
+            loss = state.log_history[-1].get("loss") if state.log_history else None
+            message = f"📊 Step {state.global_step}"
+            if loss is not None:
+                message += f": loss={loss:.4f}"
+            # Use async logging to avoid blocking
+            self._xm.add_step_closure(print, args=(message,), run_async=True)
         return control
 
 
@@ -132,7 +138,10 @@ class ValidationLossLoggerCallback(TrainerCallback):
         val_ppl = metrics.get("eval_perplexity")
         
         if val_ppl is None and val_loss is not None:
-            val_ppl = np.exp(val_loss)
+            try:
+                val_ppl = math.exp(val_loss)
+            except OverflowError:
+                val_ppl = float("inf")
         
         if val_loss is not None:
             self.validation_losses.append(val_loss)
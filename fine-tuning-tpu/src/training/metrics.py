@@ -8,6 +8,7 @@ Reference:
 - https://github.com/huggingface/transformers/issues/32307
 """
 
+import math
 import torch
 import numpy as np
 from typing import Dict
@@ -98,3 +99,28 @@ def compute_perplexity_only(eval_pred: EvalPrediction) -> Dict[str, float]:
     return {
         "perplexity": perplexity,
     }
+
+
+class PerplexityFromLossMixin:
+    """
+    Trainer mixin that adds eval_perplexity = exp(eval_loss) to eval logs.
+    
+    Replaces compute_metrics for perplexity, so the Trainer can run with
+    prediction_loss_only=True and never gather eval logits to host.
+    Hooks `Trainer.log` rather than `on_evaluate`, because evaluate() logs
+    its metrics (TensorBoard/W&B) before callbacks see them; the same dict
+    then reaches `on_evaluate`, so callbacks see the value too.
+    
+    Usage:
+        class TPUTrainer(PerplexityFromLossMixin, SFTTrainer):
+            pass
+    """
+    
+    def log(self, logs: Dict[str, float], *args, **kwargs) -> None:
+        eval_loss = logs.get("eval_loss")
+        if eval_loss is not None and "eval_perplexity" not in logs:
+            try:
+                logs["eval_perplexity"] = math.exp(eval_loss)
+            except OverflowError:
+                logs["eval_perplexity"] = float("inf")
+        super().log(logs, *args, **kwargs)